@@ -83,10 +83,10 @@ def generate_with_ai(prompt, max_tokens=8192):
 def create_ai_prompt(controller_code, dto_codes, scenarios, base_url):
     """Creates the detailed prompt for the AI to generate curl commands."""
     
-    dto_section = ""
-    if dto_codes:
-        for dto_name, dto_code in dto_codes.items():
-            dto_section += f"### DTO: {dto_name}\n```java\n{dto_code}\n```\n\n"
+    dto_section = "".join(
+        f"### DTO: {dto_name}\n```java\n{dto_code}\n```\n\n"
+        for dto_name, dto_code in (dto_codes or {}).items()
+    )
 
     scenario_instructions = ""
     if scenarios:
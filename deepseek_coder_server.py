@@ -14,6 +14,10 @@ import time
 import signal
 import sys
 import requests
+from requests.adapters import HTTPAdapter
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
 import re
 
@@ -23,10 +27,75 @@ try:
 except ImportError:
     Llama = None
 
+# BLAKE3 when installed, otherwise stdlib BLAKE2 - both take bytes and expose digest()
+try:
+    from blake3 import blake3 as content_hasher
+except ImportError:
+    from hashlib import blake2b as content_hasher
+
+# RE2 (linear-time DFA) for Java structure extraction when installed, stdlib re otherwise.
+# These patterns avoid lookaround and backreferences and use inline flags, so both engines accept them.
+try:
+    import re2 as source_re
+except ImportError:
+    source_re = re
+
+# orjson for Ollama response bodies when installed, stdlib json otherwise
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # Optimized logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Section markers in a batched multi-chunk response, e.g. "[chunk 2]" on its own line
+CHUNK_TAG_RE = re.compile(r'^[ \t]*\[chunk (\d+)\][ \t]*$', re.MULTILINE)
+
+# Model selections sent by the Java client ("6b" is the short form checked by the generator)
+SUPPORTED_MODEL_TYPES = ("auto", "deepseek-v2", "deepseek-6b", "6b")
+
+# Chunks per batched request; each gets the same 2048-token decode budget as a dedicated request
+BATCHED_CHUNKS_PER_REQUEST = 4
+
+# Java parsing patterns, compiled once at import instead of on every helper call
+METHOD_DETAILS_RE = source_re.compile(
+    r'public\s+(?:static\s+|final\s+)?([\w<>,.?\s\[\]]+)\s+([a-zA-Z_]\w*)\s*\(([^)]*)\)\s*(?:throws\s+[\w,.\s]+)?\s*{'
+)
+# Uses a negative lookahead, which RE2 does not support
+PUBLIC_METHOD_RE = re.compile(r'public\s+(?!class|interface|enum|static\s+final)\s+[\w<>,?]+\s+([a-zA-Z]\w*)\s*\(')
+STATIC_CALL_RE = source_re.compile(r'\b([A-Z]\w*)\.([a-z]\w*)\s*\(')
+CLASS_NAME_RE = source_re.compile(r'public\s+(?:class|interface|enum)\s+([\w]+)')
+PACKAGE_NAME_RE = source_re.compile(r'package\s+([\w.]+);')
+PACKAGE_DECL_RE = source_re.compile(r'package\s+[\w.]+;')
+BLOCK_COMMENT_RE = source_re.compile(r'(?s)/\*.*?\*/')
+LINE_COMMENT_RE = source_re.compile(r'//.*')
+JAVA_FENCE_RE = re.compile(r'```java\n?')
+SERVICE_RE = source_re.compile(r'@(Service|Service\s*\()')
+CONTROLLER_RE = source_re.compile(r'@(RestController|Controller)')
+REPOSITORY_RE = source_re.compile(r'@(Repository|Repository\s*\()')
+COMPONENT_RE = source_re.compile(r'@(Component|Component\s*\()')
+FIELD_INJECTION_RE = source_re.compile(
+    # Catches @Autowired, @Inject, @Resource, @Mock
+    r'@(Autowired|Inject|Resource|Mock)\s+'
+    # Handles optional access modifiers and keywords like static/final
+    r'(?:private|public|protected)?\s*'
+    r'(?:static\s+)?(?:final\s+)?'
+    r'([\w.<>\[\]]+)\s+'  # Group 1: The dependency type (e.g., List<String>)
+    r'(\w+);'             # Group 2: The dependency name
+)
+CONSTRUCTOR_PARAM_RE = source_re.compile(r'([\w.<>]+)\s+(\w+)')
+VALUE_FIELD_RE = source_re.compile(
+    r'@Value\s*\(\s*"\$\{([^}]+)\}"\s*\)\s*'
+    # Handles optional access modifiers and keywords
+    r'(?:private|public|protected)?\s*'
+    r'(?:static\s+)?(?:final\s+)?'
+    r'([\w.<>\[\]]+)\s+'  # Group 1: The field type
+    r'(\w+);'             # Group 2: The field name
+)
+
 
 class DeepSeekV2Generator:
     """
@@ -42,10 +111,19 @@ class DeepSeekV2Generator:
         self.deepseek_v2_model_name = deepseek_model_name
         self.deepseek_v2_available = False
         
+        # Pooled keep-alive connections to Ollama, reused by every status probe and generate call
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+        
         # Fallback local Llama-cpp model
         self.llm = None
         self.deepseek_6b_initialized = False
         
+        # LRU cache of per-file parse results (class name, methods, dependencies), keyed by content digest
+        self.extraction_cache = OrderedDict()
+        self.max_cache_size = 256
+        self.cache_lock = threading.Lock()
+        
         # Check for Deepseek-V2 availability on init
         self.deepseek_v2_available = self.check_deepseek_v2_status()
         if not self.deepseek_v2_available:
@@ -55,9 +133,9 @@ class DeepSeekV2Generator:
     def check_deepseek_v2_status(self):
         """Checks if the Deepseek-V2 model is available on the Ollama server."""
         try:
-            response = requests.get(f"{self.ollama_base_url}/api/tags")
+            response = self.session.get(f"{self.ollama_base_url}/api/tags")
             response.raise_for_status()
-            models = response.json().get('models', [])
+            models = json_loads(response.content).get('models', [])
             for model in models:
                 if self.deepseek_v2_model_name in model['name']:
                     logger.info(f"Found Deepseek-V2 model on Ollama: {model['name']}")
@@ -89,16 +167,17 @@ class DeepSeekV2Generator:
         
         try:
             logger.info(f"Attempting to generate with Ollama using POST {self.ollama_api_url}")
-            response = requests.post(self.ollama_api_url, json=payload, timeout=300)
+            response = self.session.post(self.ollama_api_url, json=payload, timeout=300)
             response.raise_for_status()
             
             # Ollama returns a JSON string in the 'response' field
-            response_data = response.json()
+            response_data = json_loads(response.content)
             generated_text = response_data.get('response', '')
 
             # The API response structure for generate is just the JSON object
             # but let's structure it like the OpenAI API for consistency
-            return {"choices": [{"text": generated_text}]}
+            # done_reason is "length" when num_predict cut the answer short
+            return {"choices": [{"text": generated_text, "finish_reason": response_data.get('done_reason')}]}
 
         except requests.exceptions.ConnectionError as e:
             logger.error(f"Cannot connect to Ollama at {self.ollama_base_url}. Is Ollama running?")
@@ -144,24 +223,25 @@ class DeepSeekV2Generator:
             return False, msg
 
     def _extract_methods_with_details(self, java_code):
+        """Extracts public method signatures with details (memoized per source)."""
+        # Copy so callers cannot mutate the cached list
+        return list(self._memoized_extraction('methods', java_code, self._scan_methods_with_details))
+
+    def _scan_methods_with_details(self, java_code):
         """
         Extracts public method signatures with details (name, return type, parameters).
         """
         methods = []
-        # Regex to capture public methods, their return types, names, and parameters
+        class_name = self._extract_class_name(java_code)
+        # METHOD_DETAILS_RE captures public methods, their return types, names, and parameters
         # This is a bit more robust and handles generics in return types.
-        method_pattern = re.compile(
-            r'public\s+(?:static\s+|final\s+)?([\w<>,.?\s\[\]]+)\s+([a-zA-Z_]\w*)\s*\(([^)]*)\)\s*(?:throws\s+[\w,.\s]+)?\s*{',
-            re.MULTILINE
-        )
-        
-        for match in method_pattern.finditer(java_code):
+        for match in METHOD_DETAILS_RE.finditer(java_code):
             return_type = match.group(1).strip()
             method_name = match.group(2).strip()
             params_str = match.group(3).strip()
             
             # Simple check to exclude constructors
-            if method_name == self._extract_class_name(java_code):
+            if method_name == class_name:
                 continue
 
             params = []
@@ -191,8 +271,7 @@ class DeepSeekV2Generator:
         # This regex looks for patterns like `Word.word(` and assumes it's a static call.
         # It's a heuristic and might have false positives (e.g., `object.method()`).
         # A more robust solution would involve a proper Java parser.
-        static_call_pattern = re.compile(r'\b([A-Z]\w*)\.([a-z]\w*)\s*\(')
-        matches = static_call_pattern.findall(java_code)
+        matches = STATIC_CALL_RE.findall(java_code)
         
         # We only want unique calls, like "ClassName.methodName"
         unique_calls = sorted(list(set([f"{class_name}.{method_name}" for class_name, method_name in matches])))
@@ -201,7 +280,7 @@ class DeepSeekV2Generator:
 
     def _extract_package_name(self, java_code):
         """Extracts the package name from Java code."""
-        package_match = re.search(r'package\s+([\w.]+);', java_code)
+        package_match = PACKAGE_NAME_RE.search(java_code)
         if package_match:
             return package_match.group(1)
         return ""
@@ -209,9 +288,9 @@ class DeepSeekV2Generator:
     def _remove_comments(self, java_code):
         """Removes comments from Java code to reduce token count."""
         # Remove block comments
-        code = re.sub(r'/\*.*?\*/', '', java_code, flags=re.DOTALL)
+        code = BLOCK_COMMENT_RE.sub('', java_code)
         # Remove line comments
-        code = re.sub(r'//.*', '', code)
+        code = LINE_COMMENT_RE.sub('', code)
         return code
 
     def _get_class_context(self, java_code, methods_with_details):
@@ -238,20 +317,24 @@ class DeepSeekV2Generator:
 
     def _get_class_type(self, java_code):
         """Determines if the class is a Service, Controller, Repository, or Component."""
-        if re.search(r'@(Service|Service\s*\()', java_code):
+        if SERVICE_RE.search(java_code):
             return "Service"
-        if re.search(r'@(RestController|Controller)', java_code):
+        if CONTROLLER_RE.search(java_code):
             return "Controller"
-        if re.search(r'@(Repository|Repository\s*\()', java_code):
+        if REPOSITORY_RE.search(java_code):
             return "Repository"
-        if re.search(r'@(Component|Component\s*\()', java_code):
+        if COMPONENT_RE.search(java_code):
             return "Component"
         return "Class"
 
-    def _create_chunk_generation_prompt(self, java_code, class_name, package_name, method_chunk):
-        """Creates a prompt to generate tests for a small chunk of methods."""
-        method_list = "\n".join([f"- `{m['return_type']} {m['name']}(...);`" for m in method_chunk])
-        
+    def _format_method_list(self, method_chunk):
+        """Formats a chunk of methods as the bullet list used in chunk prompts."""
+        return "\n".join([f"- `{m['return_type']} {m['name']}(...);`" for m in method_chunk])
+
+    def _create_chunk_generation_prompt(self, java_code, class_name, package_name, method_list):
+        """Creates a prompt to generate tests for a small chunk of methods.
+        Everything before the method list is identical for every chunk of a class, so Ollama
+        reuses the KV cache of that prefix and only prefills the chunk-specific tail."""
         return f"""You are a Java test engineer. Your task is to write JUnit 5 test methods for a specific set of methods from a Java class.
 
 ### Full Class Context (for reference only)
@@ -260,8 +343,7 @@ class DeepSeekV2Generator:
 ```
 
 ### INSTRUCTIONS
-- Write complete, runnable JUnit 5 `@Test` methods for the following methods ONLY:
-{method_list}
+- Write complete, runnable JUnit 5 `@Test` methods for the methods listed under METHODS TO TEST ONLY.
 - For each method, provide at least one positive and one negative test case.
 - Use the Arrange-Act-Assert pattern.
 - Assume all necessary mocks (`@Mock`) and the class under test (`@InjectMocks private {class_name} {class_name[0].lower() + class_name[1:]};`) are already defined in the test class.
@@ -269,6 +351,38 @@ class DeepSeekV2Generator:
 - DO NOT write `@BeforeEach` or other setup methods.
 - ONLY output the test methods themselves, without any surrounding markdown.
 
+### METHODS TO TEST
+{method_list}
+
+Generate the test methods now.
+"""
+
+    def _create_batched_chunk_generation_prompt(self, java_code, class_name, package_name, method_lists):
+        """Creates one prompt covering every method chunk, each tagged with a `[chunk i]` identifier."""
+        chunk_sections = "\n".join(
+            f"[chunk {i + 1}]\n{method_list}" for i, method_list in enumerate(method_lists)
+        )
+
+        return f"""You are a Java test engineer. Your task is to write JUnit 5 test methods for several groups of methods from a Java class.
+
+### Full Class Context (for reference only)
+```java
+{java_code}
+```
+
+### METHOD GROUPS
+{chunk_sections}
+
+### INSTRUCTIONS
+- Write complete, runnable JUnit 5 `@Test` methods for the methods in EACH group above.
+- For each method, provide at least one positive and one negative test case.
+- Use the Arrange-Act-Assert pattern.
+- Assume all necessary mocks (`@Mock`) and the class under test (`@InjectMocks private {class_name} {class_name[0].lower() + class_name[1:]};`) are already defined in the test class.
+- DO NOT write the class definition, package statement, or imports.
+- DO NOT write `@BeforeEach` or other setup methods.
+- Start the tests for each group with its identifier alone on a line (e.g. `[chunk 1]`), in the same order as above.
+- ONLY output the identifiers and the test methods themselves, without any surrounding markdown.
+
 Generate the test methods now.
 """
 
@@ -366,23 +480,57 @@ class {class_name}Test {{
         # Chunk methods into groups of 4 to manage prompt size
         method_chunks = [methods[i:i + 4] for i in range(0, len(methods), 4)]
         logger.info(f"Splitting {len(methods)} methods of {class_name} into {len(method_chunks)} chunks.")
+        # Formatted once; shared by the batched prompt and any per-chunk fallback
+        method_lists = [self._format_method_list(chunk) for chunk in method_chunks]
+
+        # One request per group of chunks shares the class-context prefill; the answer is split on the [chunk i] tags
+        snippets_by_chunk = {}
+        for start in range(0, len(method_chunks), BATCHED_CHUNKS_PER_REQUEST):
+            batch_lists = method_lists[start:start + BATCHED_CHUNKS_PER_REQUEST]
+            logger.info(f"Generating tests for chunks {start + 1}-{start + len(batch_lists)} of {len(method_chunks)} in a single request...")
+            batch_prompt = self._create_batched_chunk_generation_prompt(java_code, class_name, package_name, batch_lists)
+            try:
+                response = self.generate_with_deepseek_v2(batch_prompt, max_tokens=2048 * len(batch_lists))
+                choice = response['choices'][0]
+                parts = CHUNK_TAG_RE.split(choice['text'])
+                # parts = [preamble, index, body, index, body, ...]
+                batch_snippets = {}
+                last_chunk = None
+                for index, body in zip(parts[1::2], parts[2::2]):
+                    if not 1 <= int(index) <= len(batch_lists):
+                        continue
+                    last_chunk = start + int(index) - 1
+                    snippet = JAVA_FENCE_RE.sub('', body.strip())
+                    snippet = snippet.replace('```', '').strip()
+                    if snippet:
+                        batch_snippets.setdefault(last_chunk, snippet)
+                if choice.get('finish_reason') == "length":
+                    # The last section was cut off mid-test; regenerate it with a dedicated request
+                    batch_snippets.pop(last_chunk, None)
+                snippets_by_chunk.update(batch_snippets)
+            except Exception as e:
+                logger.error(f"Batched chunk generation failed for {class_name}: {e}")
 
         generated_test_snippets = []
         for i, chunk in enumerate(method_chunks):
+            if i in snippets_by_chunk:
+                generated_test_snippets.append(snippets_by_chunk[i])
+                continue
+            # Chunk missing from the batched answer: fall back to a dedicated request
             logger.info(f"Generating tests for chunk {i+1}/{len(method_chunks)}...")
-            chunk_prompt = self._create_chunk_generation_prompt(java_code, class_name, package_name, chunk)
+            chunk_prompt = self._create_chunk_generation_prompt(java_code, class_name, package_name, method_lists[i])
             try:
                 response = self.generate_with_deepseek_v2(chunk_prompt, max_tokens=2048)
                 snippet = response['choices'][0]['text']
                 # Basic cleaning of the snippet
-                snippet = re.sub(r'```java\n?', '', snippet.strip())
-                snippet = re.sub(r'```', '', snippet)
+                snippet = JAVA_FENCE_RE.sub('', snippet.strip())
+                snippet = snippet.replace('```', '')
                 generated_test_snippets.append(snippet)
             except Exception as e:
                 logger.error(f"Failed to generate tests for chunk {i+1}: {e}")
                 method_names = ", ".join([m['name'] for m in chunk])
                 generated_test_snippets.append(f"\n    // AI failed to generate tests for methods: {method_names}\n")
-        
+
         logger.info("Combining and finalizing all generated test snippets.")
         combined_snippets = "\n\n".join(generated_test_snippets)
         
@@ -408,7 +556,7 @@ class {class_name}Test {{
 
         package_name = self._extract_package_name(java_code)
         
-        line_count = len(java_code.split('\n'))
+        line_count = java_code.count('\n') + 1
         methods = self._extract_methods_with_details(java_code)
         
         # Heuristic: if the class is small (under 150 lines and < 5 methods), use single-shot.
@@ -483,10 +631,29 @@ Generate the complete and final JUnit 5 test class for `{class_name}` now.
             logger.error(f"Single-shot test generation failed for {class_name}: {e}")
             return self._generate_fallback_demo_class(class_name, package_name)
 
+    def _memoized_extraction(self, kind, java_code, extract):
+        """Runs extract(java_code) once per distinct source; repeats are LRU lookups by content digest."""
+        cache_key = (kind, content_hasher(java_code.encode()).digest())
+        with self.cache_lock:
+            if cache_key in self.extraction_cache:
+                self.extraction_cache.move_to_end(cache_key)
+                return self.extraction_cache[cache_key]
+        
+        value = extract(java_code)
+        with self.cache_lock:
+            self.extraction_cache[cache_key] = value
+            while len(self.extraction_cache) > self.max_cache_size:
+                self.extraction_cache.popitem(last=False)
+        return value
+
     def _extract_class_name(self, java_code):
+        """Extracts the primary public class name from Java code (memoized per source)."""
+        return self._memoized_extraction('class_name', java_code, self._scan_class_name)
+
+    def _scan_class_name(self, java_code):
         """Extracts the primary public class name from Java code."""
-        # Regex to find public class, interface, or enum names
-        name_match = re.search(r'public\s+(?:class|interface|enum)\s+([\w]+)', java_code)
+        # CLASS_NAME_RE finds public class, interface, or enum names
+        name_match = CLASS_NAME_RE.search(java_code)
         if name_match:
             return name_match.group(1)
             
@@ -494,8 +661,7 @@ Generate the complete and final JUnit 5 test class for `{class_name}` now.
 
     def _extract_methods(self, java_code):
         """Extracts public method names from Java code."""
-        method_pattern = re.compile(r'public\s+(?!class|interface|enum|static\s+final)\s+[\w<>,?]+\s+([a-zA-Z]\w*)\s*\(')
-        methods = method_pattern.findall(java_code)
+        methods = PUBLIC_METHOD_RE.findall(java_code)
         return methods
 
     def _clean_generated_code(self, generated_text, class_name):
@@ -503,11 +669,11 @@ Generate the complete and final JUnit 5 test class for `{class_name}` now.
         Cleans the raw output from the AI model to produce a valid Java class file.
         """
         # Remove markdown fences and surrounding whitespace
-        cleaned_text = re.sub(r'```java\n?', '', generated_text.strip())
-        cleaned_text = re.sub(r'```', '', cleaned_text)
+        cleaned_text = JAVA_FENCE_RE.sub('', generated_text.strip())
+        cleaned_text = cleaned_text.replace('```', '')
         
         # If the AI includes introductory text, find the start of the package declaration
-        package_match = re.search(r'package\s+[\w.]+;', cleaned_text)
+        package_match = PACKAGE_DECL_RE.search(cleaned_text)
         if package_match:
             # Discard any text before the package declaration
             cleaned_text = cleaned_text[package_match.start():]
@@ -522,7 +688,7 @@ Generate the complete and final JUnit 5 test class for `{class_name}` now.
     def check_ollama_running(self):
         """Check if Ollama service is running and accessible."""
         try:
-            response = requests.get(f"{self.ollama_base_url}/api/tags", timeout=5)
+            response = self.session.get(f"{self.ollama_base_url}/api/tags", timeout=5)
             return response.status_code == 200
         except requests.exceptions.RequestException:
             return False
@@ -536,6 +702,11 @@ Generate the complete and final JUnit 5 test class for `{class_name}` now.
         }
 
     def _extract_dependencies(self, java_code):
+        """Extracts injected dependencies from Java code (memoized per source)."""
+        # Copy so callers cannot mutate the cached list
+        return list(self._memoized_extraction('dependencies', java_code, self._scan_dependencies))
+
+    def _scan_dependencies(self, java_code):
         """
         Extracts injected dependencies from Java code.
         Looks for fields annotated with @Autowired, @Inject, @Mock, etc.
@@ -544,16 +715,7 @@ Generate the complete and final JUnit 5 test class for `{class_name}` now.
         dependencies = []
         
         # 1. Field Injection - More robust regex
-        field_injection_pattern = re.compile(
-            # Catches @Autowired, @Inject, @Resource, @Mock
-            r'@(Autowired|Inject|Resource|Mock)\s+'
-            # Handles optional access modifiers and keywords like static/final
-            r'(?:private|public|protected)?\s*'
-            r'(?:static\s+)?(?:final\s+)?'
-            r'([\w.<>\[\]]+)\s+'  # Group 1: The dependency type (e.g., List<String>)
-            r'(\w+);'             # Group 2: The dependency name
-        )
-        found_fields = field_injection_pattern.findall(java_code)
+        found_fields = FIELD_INJECTION_RE.findall(java_code)
         # Unpack annotation, type, and name. We only need type and name.
         for _, dep_type, dep_name in found_fields:
             dependencies.append({'name': dep_name, 'type': dep_type})
@@ -564,8 +726,8 @@ Generate the complete and final JUnit 5 test class for `{class_name}` now.
             # Regex to find the constructor, assuming it's public
             # This can be complex due to multiple constructors, annotations, etc.
             # A simplified regex for a single public constructor:
-            constructor_pattern = re.compile(
-                r'public\s+' + class_name + r'\s*\(([^)]*)\)', re.DOTALL
+            constructor_pattern = source_re.compile(
+                r'(?s)public\s+' + class_name + r'\s*\(([^)]*)\)'
             )
             match = constructor_pattern.search(java_code)
             if match:
@@ -573,8 +735,7 @@ Generate the complete and final JUnit 5 test class for `{class_name}` now.
                 # Split parameters, handling generics
                 # This simple split by comma can fail with complex generics like Map<String, List<String>>
                 # A more robust parser would be needed for that.
-                param_pattern = re.compile(r'([\w.<>]+)\s+(\w+)')
-                constructor_params = param_pattern.findall(params_str)
+                constructor_params = CONSTRUCTOR_PARAM_RE.findall(params_str)
                 for dep_type, dep_name in constructor_params:
                     # Avoid adding duplicates from field injection
                     if not any(d['name'] == dep_name for d in dependencies):
@@ -587,17 +748,9 @@ Generate the complete and final JUnit 5 test class for `{class_name}` now.
 
     def _extract_value_fields(self, java_code):
         """Extracts fields annotated with @Value."""
-        value_pattern = re.compile(
-            r'@Value\s*\(\s*"\$\{([^}]+)\}"\s*\)\s*'
-            # Handles optional access modifiers and keywords
-            r'(?:private|public|protected)?\s*'
-            r'(?:static\s+)?(?:final\s+)?'
-            r'([\w.<>\[\]]+)\s+'  # Group 1: The field type
-            r'(\w+);'             # Group 2: The field name
-        )
         # The regex groups are: (key, type, name)
         # Example: ('serverUrl', 'server.url', 'String')
-        found_values = value_pattern.findall(java_code)
+        found_values = VALUE_FIELD_RE.findall(java_code)
         return [(name, key, dtype) for key, dtype, name in found_values]
 
     def _generate_fallback_demo_class(self, class_name, package_name=None):
@@ -703,54 +856,43 @@ def initialize_model():
         logger.error(f"Failed to initialize 6.7B model: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/troubleshoot', methods=['GET'])
-def troubleshoot():
-    """Troubleshooting endpoint to diagnose Ollama connectivity issues."""
-    if not generator:
-        return jsonify({"error": "Generator not initialized"}), 503
-    
-    diagnostics = {
-        "ollama_base_url": generator.ollama_base_url,
-        "ollama_api_url": generator.ollama_api_url,
-        "tests": {}
-    }
-    
-    # Test 1: Basic connectivity
-    try:
-        response = requests.get(f"{generator.ollama_base_url}/api/tags", timeout=5)
-        diagnostics["tests"]["connectivity"] = {
+def _probe_connectivity(response, error):
+    """Troubleshooting probe: is Ollama reachable at all?"""
+    if response is not None:
+        return {
             "status": "success",
             "response_code": response.status_code,
             "message": "Ollama is accessible"
         }
-    except requests.exceptions.ConnectionError:
-        diagnostics["tests"]["connectivity"] = {
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return {
             "status": "failed",
             "error": "Connection refused",
             "message": "Ollama is not running or not accessible"
         }
-    except requests.exceptions.Timeout:
-        diagnostics["tests"]["connectivity"] = {
+    if isinstance(error, requests.exceptions.Timeout):
+        return {
             "status": "failed",
             "error": "Timeout",
             "message": "Ollama is running but not responding"
         }
-    except Exception as e:
-        diagnostics["tests"]["connectivity"] = {
-            "status": "failed",
-            "error": str(e),
-            "message": "Unknown connectivity issue"
-        }
-    
-    # Test 2: Model availability
+    return {
+        "status": "failed",
+        "error": str(error),
+        "message": "Unknown connectivity issue"
+    }
+
+def _probe_models(response, error):
+    """Troubleshooting probe: is the target model pulled?"""
     try:
-        response = requests.get(f"{generator.ollama_base_url}/api/tags", timeout=5)
+        if response is None:
+            raise error
         if response.status_code == 200:
-            models = response.json().get('models', [])
+            models = json_loads(response.content).get('models', [])
             model_names = [model['name'] for model in models]
             deepseek_models = [name for name in model_names if 'deepseek' in name.lower()]
             
-            diagnostics["tests"]["models"] = {
+            return {
                 "status": "success",
                 "available_models": model_names,
                 "deepseek_models": deepseek_models,
@@ -758,16 +900,37 @@ def troubleshoot():
                 "model_found": any(generator.deepseek_v2_model_name in name for name in model_names)
             }
         else:
-            diagnostics["tests"]["models"] = {
+            return {
                 "status": "failed",
                 "message": f"Got HTTP {response.status_code} when checking models"
             }
     except Exception as e:
-        diagnostics["tests"]["models"] = {
+        return {
             "status": "failed",
             "error": str(e),
             "message": "Could not check available models"
         }
+
+@app.route('/troubleshoot', methods=['GET'])
+def troubleshoot():
+    """Troubleshooting endpoint to diagnose Ollama connectivity issues."""
+    if not generator:
+        return jsonify({"error": "Generator not initialized"}), 503
+    
+    diagnostics = {
+        "ollama_base_url": generator.ollama_base_url,
+        "ollama_api_url": generator.ollama_api_url,
+        "tests": {}
+    }
+    
+    # Both probes are answered by a single GET /api/tags
+    response, error = None, None
+    try:
+        response = generator.session.get(f"{generator.ollama_base_url}/api/tags", timeout=5)
+    except Exception as e:
+        error = e
+    diagnostics["tests"]["connectivity"] = _probe_connectivity(response, error)
+    diagnostics["tests"]["models"] = _probe_models(response, error)
     
     # Suggestions
     suggestions = []
@@ -878,6 +1041,63 @@ def generate():
         else:
             return jsonify({"error": f"An internal error occurred: {e}"}), 500
 
+@app.route('/generate-batch', methods=['POST'])
+def generate_batch():
+    """Generates JUnit tests for several classes in one request.
+    Identical sources are generated once; distinct ones run concurrently."""
+    start_time = time.time()
+
+    if not generator:
+        return jsonify({"error": "Generator service not available"}), 503
+
+    data = request.get_json(silent=True)
+    prompts = data.get('prompts') if isinstance(data, dict) else None
+    if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p for p in prompts):
+        return jsonify({"error": "A non-empty 'prompts' list of java_code strings is required"}), 400
+
+    java_codes = prompts
+    model_type = data.get('model', 'auto')
+    if model_type not in SUPPORTED_MODEL_TYPES:
+        return jsonify({"error": f"'model' must be one of: {', '.join(SUPPORTED_MODEL_TYPES)}"}), 400
+
+    def generate_one(java_code):
+        item_start = time.time()
+        class_name = generator._extract_class_name(java_code)
+        if not class_name:
+            return {"error": "Could not determine class name from java_code."}
+        try:
+            generated_tests = generator.generate_junit_tests(java_code, class_name, model_type)
+        except Exception as e:
+            logger.error(f"Batch item generation failed for {class_name}: {e}")
+            return {"class_name": class_name, "error": str(e)}
+        return {
+            "response": generated_tests,
+            "class_name": class_name,
+            "generation_time_seconds": round(time.time() - item_start, 2)
+        }
+
+    # One generation per distinct source, keyed by content digest
+    unique_codes = {}
+    for java_code in java_codes:
+        unique_codes.setdefault(content_hasher(java_code.encode()).digest(), java_code)
+
+    logger.info(f"Batch of {len(java_codes)} prompts ({len(unique_codes)} distinct)")
+    with ThreadPoolExecutor(max_workers=min(len(unique_codes), 4)) as pool:
+        futures = {key: pool.submit(generate_one, java_code) for key, java_code in unique_codes.items()}
+
+    results = []
+    seen = set()
+    for java_code in java_codes:
+        key = content_hasher(java_code.encode()).digest()
+        results.append(dict(futures[key].result(), deduplicated=key in seen))
+        seen.add(key)
+
+    return jsonify({
+        "results": results,
+        "generation_time_seconds": round(time.time() - start_time, 2),
+        "model_used": model_type
+    })
+
 
 @app.errorhandler(404)
 def not_found(error):
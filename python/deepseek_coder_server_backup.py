@@ -2,16 +2,29 @@
 """
 OPTIMIZED JUnit Test Generator using Deepseek-Coder 6.7B-Instruct
 AWS g5.2xlarge (24GB A10G GPU + 32GB RAM + 8 vCPUs) - PRODUCTION READY
+
+Multi-worker deployment: set DEEPSEEK_MODEL_PATH so the model loads at import.
+On CPU, run with --preload so forked workers share the mmapped weights:
+  CPU: DEEPSEEK_MODEL_PATH=... DEEPSEEK_USE_GPU=0 gunicorn --preload -w 2 --threads 4 -b 0.0.0.0:8080 deepseek_coder_server_backup:app
+On GPU, never use --preload: a CUDA context created in the master does not survive
+fork, so the worker must import the app (and load the model) after forking:
+  GPU: DEEPSEEK_MODEL_PATH=... gunicorn -w 1 --threads 8 -b 0.0.0.0:8080 deepseek_coder_server_backup:app
+Both recipes keep HTTP/1.1 connections alive between requests. For HTTP/2 (h2c)
+multiplexing of concurrent requests over one connection use hypercorn:
+  hypercorn --workers 1 --bind 0.0.0.0:8080 deepseek_coder_server_backup:app
 """
 
 import argparse
 import json
 import logging
+import os
 import psutil
+import re
 import time
 import signal
 import sys
-from flask import Flask, request, jsonify
+import threading
+from flask import Flask, Response, request, jsonify, stream_with_context
 
 # Import with graceful fallback
 try:
@@ -21,6 +34,13 @@ except ImportError:
     LLAMA_CPP_AVAILABLE = False
     print("⚠️  llama-cpp-python not available - running in demo mode")
 
+try:
+    import orjson
+    from flask.json.provider import JSONProvider
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # Optimized logging
 logging.basicConfig(
     level=logging.INFO, 
@@ -29,8 +49,71 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Prompt pieces - joined once per request instead of building f-strings
+PROMPT_PREFIX = "Generate JUnit test for:\n\n"
+PROMPT_PREFIX_TRUNCATED = "Generate JUnit test for Java class:\n\n"
+PROMPT_CLASS = "\n\nTest class: "
+PROMPT_SUFFIX = "Test\n\n```java"
+PROMPT_MAX_CODE_CHARS = 600
+MAX_INPUT_CHARS = 1500
+QUICK_TEST_TTL_NS = 10 * 1_000_000_000
+# First `class` keyword in streamed output; the test class body starts at the next '{'
+CLASS_KEYWORD_RE = re.compile(r'\bclass\s')
+
+# Demo fallback skeletons - filled with str.format_map
+DEMO_TEST_METHOD_TEMPLATE = """
+    @Test
+    @DisplayName("Test {name}")
+    void test{title}() {{
+        // TODO: Implement test for {method}
+        assertNotNull({var});
+        // Add your test logic here
+    }}"""
+
+DEMO_TEST_CLASS_TEMPLATE = """import org.junit.jupiter.api.Test;
+import org.junit.jupiter.api.BeforeEach;
+import org.junit.jupiter.api.DisplayName;
+import static org.junit.jupiter.api.Assertions.*;
+
+@DisplayName("{cls} Test Suite")
+public class {cls}Test {{
+    
+    private {cls} {var};
+    
+    @BeforeEach
+    void setUp() {{
+        {var} = new {cls}();
+    }}
+{methods}
+    
+    @Test
+    @DisplayName("Test object initialization")
+    void testInitialization() {{
+        assertNotNull({var});
+    }}
+    
+    @Test
+    @DisplayName("Test basic functionality")
+    void testBasicFunctionality() {{
+        // TODO: Add your specific test cases
+        assertTrue(true, "Placeholder test");
+    }}
+}}"""
+
 app = Flask(__name__)
 
+if ORJSON_AVAILABLE:
+    class ORJSONProvider(JSONProvider):
+        """Flask JSON provider backed by orjson"""
+        
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode()
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+    
+    app.json = ORJSONProvider(app)
+
 class OptimizedDeepSeekGenerator:
     """Production-ready Deepseek-Coder 6.7B generator for AWS g5.2xlarge"""
     
@@ -45,6 +128,18 @@ class OptimizedDeepSeekGenerator:
         self.top_p = 0.95          # High for stability
         self.repeat_penalty = 1.05  # Minimal to avoid issues
         
+        # Q8_0 KV cache (GGML_TYPE_Q8_0) - half the bytes of f16 per token
+        self.kv_cache_type = 8
+        
+        # (monotonic_ns, response) of the last successful /quick-test
+        self.last_quick_test = (0, None)
+        
+        # CPU usage sampled in the background so status calls never block
+        self.cpu_percent = psutil.cpu_percent(interval=None)
+        self._start_cpu_sampler()
+        # Threads do not survive fork - restart the sampler in preloaded workers
+        os.register_at_fork(after_in_child=self._start_cpu_sampler)
+        
     def initialize_model(self, model_path, use_gpu=True):
         """Initialize model with OPTIMAL settings for AWS g5.2xlarge"""
         try:
@@ -56,8 +151,8 @@ class OptimizedDeepSeekGenerator:
             # System info
             mem = psutil.virtual_memory()
             cpu_count = psutil.cpu_count()
-            logger.info(f"System: {mem.total/(1024**3):.1f}GB RAM, {cpu_count} CPU cores")
-            logger.info(f"Available: {mem.available/(1024**3):.1f}GB RAM")
+            logger.info("System: %.1fGB RAM, %d CPU cores", mem.total/(1024**3), cpu_count)
+            logger.info("Available: %.1fGB RAM", mem.available/(1024**3))
             
             # PROVEN stable settings for g5.2xlarge
             if use_gpu:
@@ -69,7 +164,9 @@ class OptimizedDeepSeekGenerator:
                     "use_mmap": True,
                     "use_mlock": False,     # Critical: False for cloud
                     "low_vram": False,      # 24GB GPU - no need
-                    "f16_kv": True,         # Memory efficient
+                    "flash_attn": True,     # Required for quantized V cache
+                    "type_k": self.kv_cache_type,
+                    "type_v": self.kv_cache_type,
                     "logits_all": False,    # Only last token
                 }
                 logger.info("🎮 GPU MODE: 24GB A10G optimized")
@@ -81,31 +178,44 @@ class OptimizedDeepSeekGenerator:
                     "n_ctx": 1024,          # Conservative
                     "use_mmap": True,
                     "use_mlock": False,
-                    "f16_kv": True,
+                    "type_k": self.kv_cache_type,  # V cache stays f16 without flash_attn
                 }
                 logger.info("💻 CPU MODE: 8 vCPU + 32GB RAM")
             
-            logger.info(f"Loading Deepseek-Coder 6.7B from: {model_path}")
-            logger.info(f"Config: GPU={use_gpu}, Threads={config['n_threads']}, Batch={config['n_batch']}, Context={config['n_ctx']}")
+            logger.info("Loading Deepseek-Coder 6.7B from: %s", model_path)
+            logger.info("Config: GPU=%s, Threads=%d, Batch=%d, Context=%d",
+                        use_gpu, config['n_threads'], config['n_batch'], config['n_ctx'])
             
             # Initialize model with optimal settings
-            self.model = Llama(
-                model_path=model_path,
-                verbose=False,
-                **config
-            )
+            try:
+                self.model = Llama(
+                    model_path=model_path,
+                    verbose=False,
+                    **config
+                )
+            except TypeError:
+                # Older llama-cpp-python without quantized KV cache support
+                logger.warning("⚠️  Quantized KV cache not supported, falling back to f16_kv")
+                for key in ("flash_attn", "type_k", "type_v"):
+                    config.pop(key, None)
+                config["f16_kv"] = True
+                self.model = Llama(
+                    model_path=model_path,
+                    verbose=False,
+                    **config
+                )
             
             # Memory check
             mem_after = psutil.virtual_memory()
             memory_used = (mem.available - mem_after.available) / (1024**3)
-            logger.info(f"✅ Model loaded successfully!")
-            logger.info(f"📊 Memory used: {memory_used:.2f}GB, Available: {mem_after.available/(1024**3):.1f}GB")
+            logger.info("✅ Model loaded successfully!")
+            logger.info("📊 Memory used: %.2fGB, Available: %.1fGB", memory_used, mem_after.available/(1024**3))
             
             self.model_loaded = True
             return True
             
         except Exception as e:
-            logger.error(f"❌ Model loading failed: {str(e)}")
+            logger.error("❌ Model loading failed: %s", e)
             self.model_loaded = False
             return False
 
@@ -127,17 +237,11 @@ class OptimizedDeepSeekGenerator:
         if not class_name:
             class_name = self._extract_class_name(java_code)
         
-        # OPTIMIZED prompt - simple and effective
-        if len(java_code) > 600:
-            # Truncate large inputs
-            code_snippet = java_code[:600] + "..."
-            prompt = f"Generate JUnit test for Java class:\n\n{code_snippet}\n\nTest class: {class_name}Test\n\n```java"
-        else:
-            prompt = f"Generate JUnit test for:\n\n{java_code}\n\nTest class: {class_name}Test\n\n```java"
+        prompt = self._build_prompt(java_code, class_name)
         
         try:
-            start_time = time.time()
-            logger.info(f"🔄 Generating for {class_name} (prompt: {len(prompt)} chars)")
+            start_ns = time.monotonic_ns()
+            logger.info("🔄 Generating for %s (prompt: %d chars)", class_name, len(prompt))
             
             # OPTIMIZED generation call - proven settings
             output = self.model(
@@ -152,7 +256,7 @@ class OptimizedDeepSeekGenerator:
                 stream=False,  # Critical: no streaming for stability
             )
             
-            generation_time = time.time() - start_time
+            generation_time = (time.monotonic_ns() - start_ns) / 1e9
             
             # Validate output
             if not output or 'choices' not in output or not output['choices']:
@@ -163,10 +267,10 @@ class OptimizedDeepSeekGenerator:
             
             # Quick timeout check (30 seconds max)
             if generation_time > 30:
-                logger.warning(f"⏱️  Generation took {generation_time:.1f}s, using demo tests")
+                logger.warning("⏱️  Generation took %.1fs, using demo tests", generation_time)
                 return self._generate_demo_tests(java_code, class_name)
             
-            logger.info(f"✅ Generation completed in {generation_time:.2f}s")
+            logger.info("✅ Generation completed in %.2fs", generation_time)
             
             # Clean and process output
             cleaned_code = self._clean_generated_code(generated_text, class_name)
@@ -177,60 +281,97 @@ class OptimizedDeepSeekGenerator:
             return cleaned_code
             
         except Exception as e:
-            logger.error(f"❌ Generation error: {type(e).__name__}: {str(e)}")
+            logger.error("❌ Generation error: %s: %s", type(e).__name__, e)
             return self._generate_demo_tests(java_code, class_name)
 
+    def generate_junit_tests_stream(self, java_code, class_name=None):
+        """Stream generated tokens, stopping once the test class braces balance"""
+        if not class_name:
+            class_name = self._extract_class_name(java_code)
+        
+        # Fallback to demo if model not loaded
+        if not self.model or not self.model_loaded:
+            logger.info("Using demo tests - model not loaded")
+            yield self._generate_demo_tests(java_code, class_name)
+            return
+        
+        prompt = self._build_prompt(java_code, class_name)
+        logger.info("🔄 Streaming for %s (prompt: %d chars)", class_name, len(prompt))
+        
+        # Brace depth is tracked over the accumulated text: BPE tokens rarely line up
+        # with "class " or "{", so per-token checks would miss the class start
+        text = ""
+        body_start = -1  # Offset of the class body's opening brace
+        scanned = 0
+        depth = 0
+        try:
+            for chunk in self.model(
+                prompt,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                top_p=self.top_p,
+                repeat_penalty=self.repeat_penalty,
+                stop=["```"],
+                echo=False,
+                top_k=40,
+                stream=True,
+            ):
+                token = chunk['choices'][0]['text']
+                yield token
+                text += token
+                
+                if body_start < 0:
+                    match = CLASS_KEYWORD_RE.search(text)
+                    if match:
+                        body_start = text.find('{', match.end())
+                        scanned = max(body_start, 0)
+                    if body_start < 0:
+                        continue
+                
+                tail = text[scanned:]
+                depth += tail.count('{') - tail.count('}')
+                scanned = len(text)
+                
+                # Class body closed - skip decoding the tail
+                if depth <= 0:
+                    break
+        except Exception as e:
+            # Headers are already sent; end the body cleanly instead of truncating it
+            logger.error("❌ Streaming error: %s: %s", type(e).__name__, e)
+
+    def _build_prompt(self, java_code, class_name):
+        """OPTIMIZED prompt - simple and effective"""
+        if len(java_code) > PROMPT_MAX_CODE_CHARS:
+            # Truncate large inputs
+            return "".join((PROMPT_PREFIX_TRUNCATED, java_code[:PROMPT_MAX_CODE_CHARS], "...",
+                            PROMPT_CLASS, class_name, PROMPT_SUFFIX))
+        return "".join((PROMPT_PREFIX, java_code, PROMPT_CLASS, class_name, PROMPT_SUFFIX))
+
     def _generate_demo_tests(self, java_code, class_name):
         """High-quality demo tests when model fails"""
         if not class_name:
             class_name = self._extract_class_name(java_code)
         
         methods = self._extract_methods(java_code)
+        var_name = class_name.lower()
         
         # Generate test methods
         test_methods = []
         for method in methods[:3]:  # Max 3 methods
             clean_method = method.replace("()", "").replace("(", "").replace(")", "").strip()
-            test_methods.append(f"""
-    @Test
-    @DisplayName("Test {clean_method}")
-    void test{clean_method.title()}() {{
-        // TODO: Implement test for {method}
-        assertNotNull({class_name.lower()});
-        // Add your test logic here
-    }}""")
+            test_methods.append(DEMO_TEST_METHOD_TEMPLATE.format_map({
+                'name': clean_method,
+                'title': clean_method.title(),
+                'method': method,
+                'var': var_name,
+            }))
         
         # Professional demo test
-        demo_code = f"""import org.junit.jupiter.api.Test;
-import org.junit.jupiter.api.BeforeEach;
-import org.junit.jupiter.api.DisplayName;
-import static org.junit.jupiter.api.Assertions.*;
-
-@DisplayName("{class_name} Test Suite")
-public class {class_name}Test {{
-    
-    private {class_name} {class_name.lower()};
-    
-    @BeforeEach
-    void setUp() {{
-        {class_name.lower()} = new {class_name}();
-    }}
-{''.join(test_methods)}
-    
-    @Test
-    @DisplayName("Test object initialization")
-    void testInitialization() {{
-        assertNotNull({class_name.lower()});
-    }}
-    
-    @Test
-    @DisplayName("Test basic functionality")
-    void testBasicFunctionality() {{
-        // TODO: Add your specific test cases
-        assertTrue(true, "Placeholder test");
-    }}
-}}"""
-        return demo_code
+        return DEMO_TEST_CLASS_TEMPLATE.format_map({
+            'cls': class_name,
+            'var': var_name,
+            'methods': ''.join(test_methods),
+        })
 
     def _extract_class_name(self, java_code):
         """Extract class name from Java code"""
@@ -312,16 +453,24 @@ public class {class_name}Test {{
         except:
             return self._generate_demo_tests("", class_name)
 
+    def _start_cpu_sampler(self):
+        """Start the background CPU sampling thread"""
+        threading.Thread(target=self._sample_cpu_percent, daemon=True).start()
+
+    def _sample_cpu_percent(self):
+        """Refresh the cached CPU usage once per second"""
+        while True:
+            self.cpu_percent = psutil.cpu_percent(interval=1.0)
+
     def get_system_info(self):
         """Get current system status"""
         mem = psutil.virtual_memory()
-        cpu_percent = psutil.cpu_percent(interval=0.1)
         
         return {
             "total_memory_gb": round(mem.total / (1024**3), 2),
             "available_memory_gb": round(mem.available / (1024**3), 2),
             "memory_percent": round(mem.percent, 1),
-            "cpu_percent": round(cpu_percent, 1),
+            "cpu_percent": round(self.cpu_percent, 1),
             "model_loaded": self.model_loaded,
             "cache_size": len(self.generation_cache)
         }
@@ -329,6 +478,23 @@ public class {class_name}Test {{
 # Global generator instance
 generator = OptimizedDeepSeekGenerator()
 
+# Load at import time: in the master under `gunicorn --preload` (CPU only, shares the
+# mmapped weights), otherwise in each worker after fork (required with CUDA)
+if os.environ.get('DEEPSEEK_MODEL_PATH'):
+    generator.initialize_model(
+        os.environ['DEEPSEEK_MODEL_PATH'],
+        use_gpu=os.environ.get('DEEPSEEK_USE_GPU', '1') != '0'
+    )
+
+def _read_java_code(data):
+    """Return the request's Java code, truncated before any full-buffer copy"""
+    java_code = data.get('prompt') or ''
+    if len(java_code) > MAX_INPUT_CHARS:
+        logger.info("⚠️  Large input (%d chars), truncating", len(java_code))
+        # Slice first so strip() only ever copies MAX_INPUT_CHARS
+        java_code = java_code.lstrip()[:MAX_INPUT_CHARS]
+    return java_code.strip()
+
 # Routes
 @app.route('/health', methods=['GET'])
 def health():
@@ -356,7 +522,7 @@ def initialize_model():
         model_path = data.get('model_path', '/home/adminuser/models/deepseek-coder-6.7b-instruct.Q4_K_M.gguf')
         use_gpu = data.get('use_gpu', True)
         
-        logger.info(f"🚀 Initializing model: GPU={use_gpu}")
+        logger.info("🚀 Initializing model: GPU=%s", use_gpu)
         success = generator.initialize_model(model_path, use_gpu)
         
         if success:
@@ -375,7 +541,7 @@ def initialize_model():
             }), 500
             
     except Exception as e:
-        logger.error(f"❌ Initialization error: {str(e)}")
+        logger.error("❌ Initialization error: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/generate', methods=['POST'])
@@ -386,39 +552,53 @@ def generate():
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
         
-        java_code = data.get('prompt', '').strip()
+        java_code = _read_java_code(data)
         class_name = data.get('className')
         
         if not java_code:
             return jsonify({"error": "No Java code provided"}), 400
         
-        # Clean input
-        if len(java_code) > 1500:
-            logger.info(f"⚠️  Large input ({len(java_code)} chars), truncating")
-            java_code = java_code[:1500]
+        logger.info("📝 Generating tests for %s (%d chars)", class_name or 'unknown', len(java_code))
         
-        logger.info(f"📝 Generating tests for {class_name or 'unknown'} ({len(java_code)} chars)")
-        
-        start_time = time.time()
+        start_ns = time.monotonic_ns()
         
         # Generate tests
         generated_tests = generator.generate_junit_tests(java_code, class_name)
         
-        generation_time = time.time() - start_time
+        generation_time = (time.monotonic_ns() - start_ns) / 1e9
         
         return jsonify({
             "response": generated_tests,
             "generation_time_seconds": round(generation_time, 2),
             "server": "AWS g5.2xlarge",
             "model": "Deepseek-Coder 6.7B" if generator.model_loaded else "Demo Mode",
-            "input_length": len(java_code),
-            "system": generator.get_system_info()
+            "input_length": len(java_code)
         }), 200
         
     except Exception as e:
-        logger.error(f"❌ Generation error: {str(e)}")
+        logger.error("❌ Generation error: %s", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/generate-stream', methods=['POST'])
+def generate_stream():
+    """Stream JUnit tests as plain text while the model decodes"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "No JSON data provided"}), 400
+    
+    java_code = _read_java_code(data)
+    class_name = data.get('className')
+    
+    if not java_code:
+        return jsonify({"error": "No Java code provided"}), 400
+    
+    logger.info("📡 Streaming tests for %s (%d chars)", class_name or 'unknown', len(java_code))
+    
+    return Response(
+        stream_with_context(generator.generate_junit_tests_stream(java_code, class_name)),
+        mimetype='text/plain'
+    )
+
 @app.route('/quick-test', methods=['POST'])
 def quick_test():
     """Quick model functionality test"""
@@ -426,7 +606,12 @@ def quick_test():
         if not generator.model_loaded or not generator.model:
             return jsonify({"status": "model_not_loaded"}), 400
         
-        start_time = time.time()
+        # Serve a recent result so monitoring probes don't take an inference slot
+        checked_ns, cached = generator.last_quick_test
+        if cached and time.monotonic_ns() - checked_ns < QUICK_TEST_TTL_NS:
+            return jsonify(dict(cached, cached=True)), 200
+        
+        start_ns = time.monotonic_ns()
         
         # Minimal test
         output = generator.model(
@@ -437,22 +622,25 @@ def quick_test():
             stream=False
         )
         
-        generation_time = time.time() - start_time
+        generation_time = (time.monotonic_ns() - start_ns) / 1e9
         
-        return jsonify({
+        result = {
             "status": "success",
             "output": output['choices'][0]['text'] if output and 'choices' in output else "No output",
             "time": round(generation_time, 3),
             "test": "minimal"
-        }), 200
+        }
+        generator.last_quick_test = (time.monotonic_ns(), result)
+        
+        return jsonify(dict(result, cached=False)), 200
         
     except Exception as e:
-        logger.error(f"❌ Quick test failed: {str(e)}")
+        logger.error("❌ Quick test failed: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/system-status', methods=['GET'])
 def system_status():
-    """Get detailed system status"""
+    """Get detailed system status (not included in /generate responses)"""
     return jsonify(generator.get_system_info()), 200
 
 @app.route('/clear-cache', methods=['POST'])
@@ -460,6 +648,7 @@ def clear_cache():
     """Clear generation cache"""
     cache_size = len(generator.generation_cache)
     generator.generation_cache.clear()
+    generator.last_quick_test = (0, None)
     return jsonify({
         "status": "success",
         "message": f"Cleared {cache_size} cached items",
@@ -483,29 +672,29 @@ if __name__ == '__main__':
     parser.add_argument('--use-gpu', action='store_true', default=True, help='Enable GPU')
     args = parser.parse_args()
     
-    # System info
-    mem = psutil.virtual_memory()
-    cpu_count = psutil.cpu_count()
+    # Startup banner
+    if logger.isEnabledFor(logging.INFO):
+        mem = psutil.virtual_memory()
     
-    logger.info("🚀 OPTIMIZED Deepseek-Coder 6.7B Server - AWS g5.2xlarge")
-    logger.info("=" * 60)
-    logger.info("🖥️  Instance: AWS g5.2xlarge")
-    logger.info("🎮 GPU: 24GB A10G NVIDIA")
-    logger.info("💾 RAM: 32GB DDR4")
-    logger.info("⚡ CPU: 8 vCPUs (AMD EPYC 7R32)")
-    logger.info("🤖 Model: Deepseek-Coder 6.7B-Instruct (Q4_K_M)")
-    logger.info("=" * 60)
-    logger.info(f"💻 Available: {mem.available/(1024**3):.1f}GB RAM ({100-mem.percent:.1f}% free)")
-    logger.info(f"🌐 Server: {args.host}:{args.port}")
-    logger.info(f"🎯 GPU: {'Enabled' if args.use_gpu else 'Disabled'}")
-    logger.info("=" * 60)
+        logger.info("🚀 OPTIMIZED Deepseek-Coder 6.7B Server - AWS g5.2xlarge")
+        logger.info("=" * 60)
+        logger.info("🖥️  Instance: AWS g5.2xlarge")
+        logger.info("🎮 GPU: 24GB A10G NVIDIA")
+        logger.info("💾 RAM: 32GB DDR4")
+        logger.info("⚡ CPU: 8 vCPUs (AMD EPYC 7R32)")
+        logger.info("🤖 Model: Deepseek-Coder 6.7B-Instruct (Q4_K_M)")
+        logger.info("=" * 60)
+        logger.info("💻 Available: %.1fGB RAM (%.1f%% free)", mem.available/(1024**3), 100-mem.percent)
+        logger.info("🌐 Server: %s:%s", args.host, args.port)
+        logger.info("🎯 GPU: %s", 'Enabled' if args.use_gpu else 'Disabled')
+        logger.info("=" * 60)
     
-    if args.use_gpu:
-        logger.info("🔥 PRODUCTION GPU MODE")
-        logger.info("⚡ Expected: 3-15 seconds per generation")
-    else:
-        logger.info("🔥 CPU MODE")
-        logger.info("⚡ Expected: 10-30 seconds per generation")
+        if args.use_gpu:
+            logger.info("🔥 PRODUCTION GPU MODE")
+            logger.info("⚡ Expected: 3-15 seconds per generation")
+        else:
+            logger.info("🔥 CPU MODE")
+            logger.info("⚡ Expected: 10-30 seconds per generation")
     
     logger.info("✅ Ready for requests!")
     
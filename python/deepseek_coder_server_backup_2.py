@@ -4,17 +4,46 @@ OPTIMIZED JUnit Test Generator using Deepseek-Coder-V2:16b
 - Deepseek-Coder-V2:16b (Ollama) - PRIMARY MODEL
 - Deepseek-Coder 6.7B-Instruct (Local llama-cpp) - FALLBACK
 AWS g5.2xlarge (24GB A10G GPU + 32GB RAM + 8 vCPUs) - PRODUCTION READY
+
+Concurrent requests are dispatched to Ollama in parallel slots; start Ollama
+with OLLAMA_NUM_PARALLEL=4 to match OllamaSlotLimiter's max_concurrent.
+
+Production: serve with gevent workers so requests waiting on Ollama overlap
+(the gevent worker monkey-patches requests/threading itself):
+  gunicorn --worker-class gevent --workers 2 --worker-connections 64 --timeout 180 \
+      -b 0.0.0.0:8080 deepseek_coder_server_backup_2:app
+`python deepseek_coder_server_backup_2.py` still runs the Flask development server.
+
+Optional vLLM backend (AWQ INT4, paged attention, continuous batching) replaces Ollama
+for the deepseek-v2 path when VLLM_BASE_URL is set:
+  vllm serve deepseek-ai/DeepSeek-Coder-V2-Lite-Instruct-AWQ --quantization awq \
+      --max-num-batched-tokens 8192 --enable-prefix-caching --max-model-len 4096 \
+      --gpu-memory-utilization 0.92 \
+      --speculative-model "[ngram]" --ngram-prompt-lookup-max 4 --num-speculative-tokens 5
+  (Prompt-lookup speculation needs no draft weights; a draft model would have to share
+  DeepSeek-Coder-V2's tokenizer/vocabulary, which the small Qwen/CodeLlama models do not.)
+  VLLM_BASE_URL=http://127.0.0.1:8000 VLLM_MODEL=deepseek-ai/DeepSeek-Coder-V2-Lite-Instruct-AWQ \
+      python deepseek_coder_server_backup_2.py
 """
 
 import argparse
 import json
 import logging
+import os
 import psutil
+import queue
+import re
+import threading
 import time
 import signal
 import sys
+import zlib
 import requests
-from flask import Flask, request, jsonify
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from flask import Flask, Response, request, jsonify, stream_with_context
 
 # Import with graceful fallback
 try:
@@ -24,9 +53,50 @@ except ImportError:
     LLAMA_CPP_AVAILABLE = False
     print("⚠️  llama-cpp-python not available - Deepseek 6.7B fallback will use demo mode")
 
+# Prompt-lookup speculative decoding (needs llama-cpp-python >= 0.2.58, no draft weights)
+try:
+    from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+except ImportError:
+    LlamaPromptLookupDecoding = None
+
+# tree-sitter Java grammar for single-pass method extraction (regex fallback otherwise)
+try:
+    import tree_sitter_java
+    from tree_sitter import Language, Parser
+    JAVA_LANGUAGE = Language(tree_sitter_java.language())
+except Exception:
+    JAVA_LANGUAGE = None
+
+# Shared cache across gunicorn workers and restarts when REDIS_URL is set
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# BLAKE3 when installed, otherwise stdlib BLAKE2 - both take bytes and expose update()/digest()
+try:
+    from blake3 import blake3 as content_hasher
+except ImportError:
+    from hashlib import blake2b as content_hasher
+
+# orjson for request/response bodies and Ollama/vLLM stream chunks
+try:
+    import orjson
+    from flask.json.provider import JSONProvider
+    ORJSON_AVAILABLE = True
+    json_loads = orjson.loads
+    
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    ORJSON_AVAILABLE = False
+    json_loads = json.loads
+    json_dumps = json.dumps
+
 # Optimized logging
 logging.basicConfig(
-    level=logging.INFO, 
+    level=os.environ.get('LOG_LEVEL', 'INFO'),  # Set LOG_LEVEL=WARNING in production
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[logging.StreamHandler(sys.stdout)]
 )
@@ -34,6 +104,126 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+if ORJSON_AVAILABLE:
+    class ORJSONProvider(JSONProvider):
+        """Flask JSON provider backed by orjson"""
+        
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode()
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+    
+    app.json = ORJSONProvider(app)
+
+# Java parsing patterns, compiled once
+CLASS_NAME_RE = re.compile(r'public\s+(?:final\s+)?class\s+(\w+)')
+PUBLIC_METHOD_RE = re.compile(
+    r'public\s+(?:static\s+)?'  # Modifier
+    r'[\w\<\>\[\]\.,\s]+?\s+'  # Non-greedy return type
+    r'(\w+)\s*'  # Method Name (the only capture group)
+    r'\([\s\S]*?\)\s*'  # Parameters (multi-line)
+    r'(?:throws\s+[\w\.,\s]+)?\s*{'
+)
+JAVA_CODE_BLOCK_RE = re.compile(r'```java\s*(.*?)```', re.DOTALL)
+IMPORT_LINE_RE = re.compile(r'^import ', re.MULTILINE)
+
+
+# Declarations whose direct children can hold method declarations
+JAVA_CONTAINER_NODES = {
+    'program', 'class_declaration', 'class_body', 'interface_declaration', 'interface_body',
+    'enum_declaration', 'enum_body', 'enum_body_declarations', 'record_declaration',
+}
+
+
+def _is_public(node):
+    modifiers = next((c for c in node.children if c.type == 'modifiers'), None)
+    return modifiers is not None and any(c.type == 'public' for c in modifiers.children)
+
+
+def _parse_java_tree(java_code):
+    """Return (first public class name or None, public method names with bodies) from one tree-sitter parse"""
+    tree = Parser(JAVA_LANGUAGE).parse(java_code.encode())
+    class_name = None
+    names = []
+    stack = [tree.root_node]
+    while stack:
+        node = stack.pop()
+        if node.type == 'method_declaration':
+            if _is_public(node) and node.child_by_field_name('body') is not None:
+                names.append(node.child_by_field_name('name').text.decode())
+        elif node.type in JAVA_CONTAINER_NODES:
+            if class_name is None and node.type == 'class_declaration' and _is_public(node):
+                class_name = node.child_by_field_name('name').text.decode()
+            # Only walk declarations, never statement bodies
+            stack.extend(reversed(node.named_children))
+    return class_name, names
+
+
+class ServerBusyError(Exception):
+    """Raised when the Ollama request queue is full"""
+
+
+class OllamaSlotLimiter:
+    """Bounded queue in front of Ollama that dispatches each call into a free parallel slot"""
+    
+    def __init__(self, generate_fn, max_concurrent=4, max_queue=32):
+        self.generate_fn = generate_fn
+        self.max_concurrent = max_concurrent
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.slots = threading.Semaphore(max_concurrent)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent)
+        # Streaming requests waiting for a slot count against the same queue bound
+        self.streams_waiting = 0
+        self.streams_lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+    
+    def check_capacity(self):
+        """Raise ServerBusyError when queued calls plus waiting streams fill the queue bound"""
+        if self.queue.qsize() + self.streams_waiting >= self.queue.maxsize:
+            raise ServerBusyError(f"Ollama queue is full ({self.queue.maxsize} pending requests)")
+    
+    @contextmanager
+    def stream_slot(self):
+        """Admit a streaming call and hold one Ollama slot while it runs"""
+        with self.streams_lock:
+            self.check_capacity()
+            self.streams_waiting += 1
+        try:
+            self.slots.acquire()
+        finally:
+            with self.streams_lock:
+                self.streams_waiting -= 1
+        try:
+            yield
+        finally:
+            self.slots.release()
+    
+    def submit(self, prompt, max_tokens=None):
+        """Queue a generation and block until its slot completes it"""
+        future = Future()
+        try:
+            self.queue.put_nowait((prompt, max_tokens, future))
+        except queue.Full:
+            raise ServerBusyError(f"Ollama queue is full ({self.queue.maxsize} pending requests)")
+        return future.result()
+    
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            # Wait for a free Ollama slot so backlog stays in the bounded queue
+            self.slots.acquire()
+            self.executor.submit(self._dispatch, *item)
+    
+    def _dispatch(self, prompt, max_tokens, future):
+        try:
+            future.set_result(self.generate_fn(prompt, max_tokens))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self.slots.release()
+
+
 class DeepSeekV2Generator:
     """Production-ready Deepseek-Coder-V2:16b generator for AWS g5.2xlarge"""
     
@@ -43,12 +233,41 @@ class DeepSeekV2Generator:
         self.ollama_model = "deepseek-coder-v2:16b"
         self.deepseek_v2_available = False
         
+        # Optional vLLM OpenAI-compatible server serving Deepseek-V2 instead of Ollama
+        self.vllm_base_url = os.environ.get('VLLM_BASE_URL')
+        self.vllm_model = os.environ.get('VLLM_MODEL', "deepseek-ai/DeepSeek-Coder-V2-Lite-Instruct-AWQ")
+        
+        # Pooled keep-alive connections to Ollama
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+        # vLLM batches continuously on its own, so allow more requests in flight
+        self.scheduler = OllamaSlotLimiter(
+            self._generate_with_deepseek_v2_now,
+            max_concurrent=16 if self.vllm_base_url else 4
+        )
+        # Shared pool for CPU-bound parsing that overlaps the I/O-bound model call
+        self.cpu_pool = ThreadPoolExecutor(max_workers=2)
+        
         # Fallback local Deepseek 6.7B model
         self.deepseek_6b_model = None
         self.deepseek_6b_loaded = False
+        self.deepseek_6b_prefix_tokens = None
+        self.deepseek_6b_prefix_state = None
+        
+        # Shared LRU cache keyed by a content digest
+        self.generation_cache = OrderedDict()
+        self.max_cache_size = 256
+        self.cache_lock = threading.Lock()
         
-        # Shared cache
-        self.generation_cache = {}
+        # Optional Redis tier behind the in-process LRU
+        self.redis_cache = None
+        self.redis_ttl_seconds = 86400
+        redis_url = os.environ.get('REDIS_URL')
+        if redis_url and REDIS_AVAILABLE:
+            self.redis_cache = redis.Redis.from_url(redis_url, decode_responses=False)
+            logger.info(f"🗄️  Redis generation cache enabled at {redis_url}")
+        elif redis_url:
+            logger.warning("⚠️  REDIS_URL set but redis is not installed - using in-process cache only")
         
         # OPTIMIZED settings for Deepseek-Coder-V2:16b
         self.max_tokens = 2048      # Adjusted for memory stability on large inputs
@@ -56,29 +275,73 @@ class DeepSeekV2Generator:
         self.top_p = 0.95          # High for stability
         self.repeat_penalty = 1.05  # Minimal to avoid issues
         
-        self.prompt_template = """### Instruction:
-You are an expert Java test engineer. Your task is to generate a complete, high-quality JUnit 5 test class for the provided Java source code.
+        # Fixed instruction header - kept byte-identical so Ollama can reuse its KV cache
+        self.system_prompt = """You are an expert Java test engineer. Your task is to generate a complete, high-quality JUnit 5 test class for the provided Java source code.
 Your response must be only the raw Java code for the test class, enclosed in a single '```java' block.
-Do not add any comments, explanations, or introductory text outside the code block.
-
-### Input Java Class:
+Do not add any comments, explanations, or introductory text outside the code block."""
+        
+        self.prompt_template = """### Input Java Class:
 {java_code}
 
 ### Response (JUnit 5 Test Class):
 ```java
 """
+        
+        # Pre-split once so each request is a plain join instead of str.format
+        self.prompt_prefix, self.prompt_suffix = self.prompt_template.split("{java_code}")
+        
+        # llama-cpp has no system field - the 6.7B model gets the instruction inline
+        self.deepseek_6b_instruction = f"### Instruction:\n{self.system_prompt}\n\n"
+        
+        # Rough token budget (~3 chars/token for Java) so over-long inputs skip generation
+        # instead of being silently truncated by Ollama or exhausting llama-cpp's context
+        self.prompt_overhead_tokens = (len(self.deepseek_6b_instruction) + len(self.prompt_template)) // 3
+        self.min_output_tokens = 512
+        self.deepseek_6b_n_ctx = 2048
+        
+        # Keep the model (and cached prefix) resident; num_ctx must not change between calls
+        self.ollama_keep_alive = "30m"
+        self.ollama_num_ctx = 4096
+        
+        # Backend probe result is reused for a short TTL and refreshed in the background
+        self.status_checked_at = None
+        self.status_ttl_seconds = 10
+        # CPU usage averaged over each refresh interval, so /health never blocks sampling it
+        self.cpu_percent = 0.0
+        self._start_status_refresher()
+        # Threads don't survive fork - restart the refresher in each gunicorn worker
+        os.register_at_fork(after_in_child=self._start_status_refresher)
+
+    def _start_status_refresher(self):
+        threading.Thread(target=self._refresh_status, daemon=True).start()
 
-    def check_deepseek_v2_status(self):
+    def _refresh_status(self):
+        while True:
+            self.check_deepseek_v2_status(force=True)
+            self.cpu_percent = psutil.cpu_percent(interval=None)
+            time.sleep(self.status_ttl_seconds)
+
+    def check_deepseek_v2_status(self, force=False):
+        """Return Deepseek-V2 availability, probing the backend at most once per TTL"""
+        if (not force and self.status_checked_at is not None
+                and time.monotonic() - self.status_checked_at < self.status_ttl_seconds):
+            return self.deepseek_v2_available
+        available = self.check_vllm_status() if self.vllm_base_url else self.check_ollama_status()
+        self.status_checked_at = time.monotonic()
+        return available
+
+    def check_ollama_status(self):
         """Check if Ollama Deepseek-Coder-V2:16b is available"""
         try:
-            response = requests.get(f"{self.ollama_base_url}/api/tags", timeout=5)
+            response = self.session.get(f"{self.ollama_base_url}/api/tags", timeout=5)
             if response.status_code == 200:
-                models = response.json().get('models', [])
+                models = json_loads(response.content).get('models', [])
                 for model in models:
                     model_name = model.get('name', '').lower()
                     if 'deepseek-coder-v2' in model_name and '16b' in model_name:
+                        if not self.deepseek_v2_available:
+                            logger.info(f"✅ Deepseek-Coder-V2:16b available: {model.get('name')}")
                         self.deepseek_v2_available = True
-                        logger.info(f"✅ Deepseek-Coder-V2:16b available: {model.get('name')}")
                         return True
                 logger.warning("⚠️  Ollama running but Deepseek-Coder-V2:16b model not found")
                 
@@ -89,79 +352,153 @@ Do not add any comments, explanations, or introductory text outside the code blo
                         self.ollama_model = model.get('name')
                         self.deepseek_v2_available = True
                         return True
+                self.deepseek_v2_available = False
                 return False
             else:
                 logger.warning(f"⚠️  Ollama responded with status {response.status_code}")
+                self.deepseek_v2_available = False
                 return False
         except Exception as e:
-            logger.warning(f"⚠️  Ollama not available: {str(e)}")
+            if self.deepseek_v2_available or self.status_checked_at is None:
+                logger.warning(f"⚠️  Ollama not available: {str(e)}")
             self.deepseek_v2_available = False
             return False
     
-    def generate_with_deepseek_v2(self, prompt, max_tokens=None):
-        """Generate using Ollama Deepseek-Coder-V2:16b"""
+    def check_vllm_status(self):
+        """Check if the vLLM server is serving the configured Deepseek-V2 model"""
         try:
-            if not self.deepseek_v2_available:
-                raise Exception("Deepseek-Coder-V2 not available")
+            response = self.session.get(f"{self.vllm_base_url}/v1/models", timeout=5)
+            if response.status_code == 200:
+                served = [m.get('id') for m in json_loads(response.content).get('data', [])]
+                self.deepseek_v2_available = self.vllm_model in served
+                if not self.deepseek_v2_available:
+                    logger.warning(f"⚠️  vLLM running but '{self.vllm_model}' not served (serving: {served})")
+                return self.deepseek_v2_available
+            logger.warning(f"⚠️  vLLM responded with status {response.status_code}")
+            self.deepseek_v2_available = False
+            return False
+        except Exception as e:
+            if self.deepseek_v2_available or self.status_checked_at is None:
+                logger.warning(f"⚠️  vLLM not available: {str(e)}")
+            self.deepseek_v2_available = False
+            return False
+    
+    def stream_with_vllm(self, prompt, max_tokens=None):
+        """Yield response fragments from vLLM's OpenAI-compatible chat completions API"""
+        payload = {
+            "model": self.vllm_model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "stream": True,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "repetition_penalty": self.repeat_penalty,
+            "max_tokens": max_tokens or self.max_tokens
+        }
+        
+        with self.session.post(
+            f"{self.vllm_base_url}/v1/chat/completions",
+            json=payload,
+            stream=True,
+            timeout=(5, 120)
+        ) as response:
+            if response.status_code != 200:
+                raise Exception(f"vLLM API error: {response.status_code} - {response.text}")
             
-            payload = {
-                "model": self.ollama_model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": self.temperature,
-                    "top_p": self.top_p,
-                    "repeat_penalty": self.repeat_penalty,
-                    "num_predict": max_tokens or self.max_tokens,
-                    "num_ctx": 4096  # Adjusted for stability with large prompts
-                }
+            # Server-sent events: 'data: {...}' lines terminated by 'data: [DONE]'
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[6:]
+                if data == b"[DONE]":
+                    break
+                choices = json_loads(data).get('choices') or [{}]
+                yield choices[0].get('delta', {}).get('content') or ''
+    
+    def stream_with_deepseek_v2(self, prompt, max_tokens=None):
+        """Yield response fragments from Ollama Deepseek-Coder-V2:16b as they are generated"""
+        if not self.deepseek_v2_available:
+            raise Exception("Deepseek-Coder-V2 not available")
+        
+        if self.vllm_base_url:
+            yield from self.stream_with_vllm(prompt, max_tokens)
+            return
+        
+        payload = {
+            "model": self.ollama_model,
+            "system": self.system_prompt,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": self.ollama_keep_alive,
+            "options": {
+                "temperature": self.temperature,
+                "top_p": self.top_p,
+                "repeat_penalty": self.repeat_penalty,
+                "num_predict": max_tokens or self.max_tokens,
+                "num_ctx": self.ollama_num_ctx
             }
-            
-            logger.info("--- Full Prompt Sent to Model ---")
-            logger.info(prompt)
-            logger.info("-----------------------------------")
+        }
+        
+        # Full prompt and cURL dump are O(len(java_code)) - only build them for DEBUG
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("--- Full Prompt Sent to Model ---")
+            logger.debug(prompt)
+            logger.debug("-----------------------------------")
 
             try:
-                import json
                 curl_url = f"{self.ollama_base_url}/api/generate"
-                # Pretty-print the JSON for the here document, making it readable and safe
-                json_payload_str = json.dumps(payload, indent=2)
+                json_payload_str = json.dumps(payload)
                 # Use a heredoc for robustness. The user can copy-paste the entire multi-line command.
                 # The 'EOF' is quoted to prevent shell expansion within the JSON.
                 curl_command = f"""curl -X POST '{curl_url}' -H "Content-Type: application/json" --data @- <<'EOF'
 {json_payload_str}
 EOF"""
                 
-                logger.info("")
-                logger.info("")
-                logger.info("--- Equivalent cURL Command for Debugging ---")
-                logger.info("# (Run this in your terminal. It uses a 'here document' for safety.)")
-                logger.info(curl_command)
-                logger.info("---------------------------------------------")
-                logger.info("")
-                logger.info("")
+                logger.debug("--- Equivalent cURL Command for Debugging ---")
+                logger.debug("# (Run this in your terminal. It uses a 'here document' for safety.)")
+                logger.debug(curl_command)
+                logger.debug("---------------------------------------------")
             except Exception as e:
                 logger.warning(f"⚠️  Could not generate cURL command for logging: {e}")
 
-            logger.info("--- Sending POST request to Ollama server ---")
-            
-            response = requests.post(
-                f"{self.ollama_base_url}/api/generate", 
-                json=payload, 
-                timeout=120  # Increased timeout for longer generation
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                response_text = result.get('response', '')
-                # Prepare truncated text for safe logging
-                truncated_text = response_text.replace('\n', ' ')[:400]
-                logger.info(f"📝 Deepseek raw response (truncated): {truncated_text}...")
-                return {
-                    'choices': [{'text': response_text}]
-                }
-            else:
+        logger.info("--- Sending POST request to Ollama server ---")
+        
+        with self.session.post(
+            f"{self.ollama_base_url}/api/generate",
+            json=payload,
+            stream=True,
+            timeout=(5, 120)  # Connect timeout, then max wait between chunks
+        ) as response:
+            if response.status_code != 200:
                 raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+            
+            # Ollama streams one JSON object per line
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json_loads(line)
+                if 'error' in chunk:
+                    raise Exception(f"Ollama API error: {chunk['error']}")
+                yield chunk.get('response', '')
+                if chunk.get('done'):
+                    break
+
+    def generate_with_deepseek_v2(self, prompt, max_tokens=None):
+        """Generate using Ollama Deepseek-Coder-V2:16b through the Ollama slot limiter"""
+        return self.scheduler.submit(prompt, max_tokens)
+
+    def _generate_with_deepseek_v2_now(self, prompt, max_tokens=None):
+        """Generate using Ollama Deepseek-Coder-V2:16b"""
+        try:
+            response_text = ''.join(self.stream_with_deepseek_v2(prompt, max_tokens))
+            # Prepare truncated text for safe logging
+            truncated_text = response_text[:400].replace('\n', ' ')
+            logger.info(f"📝 Deepseek raw response (truncated): {truncated_text}...")
+            return {
+                'choices': [{'text': response_text}]
+            }
                 
         except Exception as e:
             logger.error(f"❌ Deepseek-V2 generation failed: {str(e)}")
@@ -186,12 +523,16 @@ EOF"""
                 config = {
                     "n_gpu_layers": -1,
                     "n_threads": 4,
-                    "n_batch": 256,
-                    "n_ctx": 2048, # Increased context
+                    "n_batch": 512,     # Prefill is compute-bound - fill the GPU
+                    "n_ubatch": 512,
+                    "n_ctx": self.deepseek_6b_n_ctx, # Increased context
                     "use_mmap": True,
                     "use_mlock": False,
                     "low_vram": False,
-                    "f16_kv": True,
+                    "flash_attn": True,  # Required for quantized V cache
+                    "offload_kqv": True,
+                    "type_k": 8,        # q8_0 KV cache halves KV bandwidth
+                    "type_v": 8,
                     "logits_all": False,
                 }
                 logger.info("🎮 GPU MODE: 24GB A10G optimized")
@@ -200,16 +541,31 @@ EOF"""
                     "n_gpu_layers": 0,
                     "n_threads": 6,
                     "n_batch": 128,
-                    "n_ctx": 2048,
+                    "n_ctx": self.deepseek_6b_n_ctx,
                     "use_mmap": True,
                     "use_mlock": False,
                     "f16_kv": True,
                 }
                 logger.info("💻 CPU MODE: 8 vCPU + 32GB RAM")
             
+            # Test code repeats the source's identifiers and boilerplate, so drafting
+            # tokens from n-grams already in the prompt gets a high acceptance rate
+            if LlamaPromptLookupDecoding is not None:
+                config["draft_model"] = LlamaPromptLookupDecoding(num_pred_tokens=10 if use_gpu else 2)
+                logger.info("⚡ Prompt-lookup speculative decoding enabled")
+            
             logger.info(f"Loading Deepseek-Coder 6.7B from: {model_path}")
             
-            self.deepseek_6b_model = Llama(model_path=model_path, verbose=False, **config)
+            try:
+                self.deepseek_6b_model = Llama(model_path=model_path, verbose=False, **config)
+            except TypeError:
+                # Older llama-cpp-python without flash attention / quantized KV cache
+                logger.warning("⚠️  Quantized KV cache not supported, falling back to f16_kv")
+                for key in ("n_ubatch", "flash_attn", "offload_kqv", "type_k", "type_v"):
+                    config.pop(key, None)
+                config["f16_kv"] = True
+                self.deepseek_6b_model = Llama(model_path=model_path, verbose=False, **config)
+            self._prefill_6b_prefix()
             
             mem_after = psutil.virtual_memory()
             memory_used = (mem.available - mem_after.available) / (1024**3)
@@ -223,6 +579,24 @@ EOF"""
             self.deepseek_6b_loaded = False
             return False
 
+    def _prefill_6b_prefix(self):
+        """Evaluate the fixed instruction header once and checkpoint its KV cache"""
+        prefix = self.deepseek_6b_instruction + self.prompt_prefix
+        self.deepseek_6b_prefix_tokens = self.deepseek_6b_model.tokenize(prefix.encode())
+        self.deepseek_6b_model.reset()
+        self.deepseek_6b_model.eval(self.deepseek_6b_prefix_tokens)
+        self.deepseek_6b_prefix_state = self.deepseek_6b_model.save_state()
+        logger.info(f"🧠 Pre-filled {len(self.deepseek_6b_prefix_tokens)} instruction tokens")
+
+    def _restore_6b_prefix(self):
+        """Reload the header checkpoint unless the live context already starts with it"""
+        model = self.deepseek_6b_model
+        n_prefix = len(self.deepseek_6b_prefix_tokens)
+        # llama-cpp skips re-evaluating the longest token prefix shared with its context
+        if model.n_tokens >= n_prefix and model.input_ids[:n_prefix].tolist() == self.deepseek_6b_prefix_tokens:
+            return
+        model.load_state(self.deepseek_6b_prefix_state)
+
     def generate_junit_tests(self, java_code, class_name=None, model_type="auto"):
         """Generate JUnit tests with DEEPSEEK-V2 SUPPORT"""
         logger.info("--- Starting Test Generation Pipeline ---")
@@ -238,60 +612,154 @@ EOF"""
                 model_type = "demo"
             logger.info(f"🤖 Auto-selected model: {model_type}")
 
-        cache_key = hash(java_code + str(class_name) + model_type)
-        if cache_key in self.generation_cache:
-            logger.info(f"📦 Returning cached result for key {cache_key}")
-            return self.generation_cache[cache_key]
+        cache_key = self._cache_key(java_code, class_name, model_type)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            logger.info(f"📦 Returning cached result for key {cache_key.hex()}")
+            return cached
         
         logger.info("Cache miss. Proceeding with new generation.")
-        if not class_name:
-            class_name = self._extract_class_name(java_code)
+        # Parse on the shared CPU pool while the model call is in flight
+        parse_future = self.cpu_pool.submit(self._parse_java, java_code)
+        
+        def demo_tests():
+            parsed_class_name, methods = parse_future.result()
+            return self._generate_demo_tests(java_code, class_name or parsed_class_name, methods)
         
-        methods = self._extract_methods(java_code)
-        method_list = "\n".join([f"- {m}" for m in methods]) if methods else "No public methods found to test."
+        if model_type != "demo" and self._input_too_large(java_code, model_type):
+            return demo_tests(), "Demo Mode (input too large)"
         
         # New, robust prompt format for instruction-tuned models
-        prompt = self.prompt_template.format(
-            java_code=java_code
-        )
+        prompt = self._build_prompt(java_code)
         
         try:
             start_time = time.time()
-            logger.info(f"🔄 Generating for {class_name} using {model_type.upper()} (prompt: {len(prompt)} chars)")
+            logger.info(f"🔄 Generating for {class_name or 'Java input'} using {model_type.upper()} (prompt: {len(prompt)} chars)")
             
             if model_type == "deepseek-v2" and self.deepseek_v2_available:
                 output = self.generate_with_deepseek_v2(prompt, self.max_tokens)
                 model_name = "Deepseek-Coder-V2:16b"
             elif model_type == "deepseek-6b" and self.deepseek_6b_loaded and self.deepseek_6b_model:
-                output = self.deepseek_6b_model(prompt, max_tokens=self.max_tokens, temperature=self.temperature, top_p=self.top_p, repeat_penalty=self.repeat_penalty, stop=["```", "}\n}"], echo=False)
+                full_prompt = self.deepseek_6b_instruction + prompt
+                self._restore_6b_prefix()
+                output = self.deepseek_6b_model(full_prompt, max_tokens=self.max_tokens, temperature=self.temperature, top_p=self.top_p, repeat_penalty=self.repeat_penalty, stop=["```", "}\n}"], echo=False)
                 model_name = "Deepseek-Coder 6.7B"
             else:
                 logger.warning(f"⚠️  Model '{model_type}' not available, using demo tests.")
-                return self._generate_demo_tests(java_code, class_name), "Demo Mode"
+                return demo_tests(), "Demo Mode"
             
             generation_time = time.time() - start_time
             
             if not output or 'choices' not in output or not output['choices'] or not output['choices'][0]['text'].strip():
                 logger.warning("⚠️  Model returned an empty response. Falling back to demo tests.")
-                return self._generate_demo_tests(java_code, class_name), "Demo Mode"
+                return demo_tests(), "Demo Mode"
             
             logger.info(f"✅ Generation completed in {generation_time:.2f}s using {model_name}")
             
             generated_text = output['choices'][0]['text']
+            class_name = class_name or parse_future.result()[0]
             cleaned_code = self._clean_generated_code(generated_text, class_name)
             
             if not self._validate_generated_code(cleaned_code, class_name):
                 logger.warning("⚠️  Generated code failed validation. Falling back to demo tests.")
-                return self._generate_demo_tests(java_code, class_name), "Demo Mode"
+                return demo_tests(), "Demo Mode"
             
             logger.info("✅ Code validation successful.")
             result_tuple = (cleaned_code, model_name)
-            self.generation_cache[cache_key] = result_tuple
+            self._cache_put(cache_key, result_tuple)
             return result_tuple
             
+        except ServerBusyError:
+            raise
         except Exception as e:
             logger.error(f"❌ Exception in generation pipeline: {type(e).__name__}: {str(e)}")
-            return self._generate_demo_tests(java_code, class_name), "Demo Mode"
+            return demo_tests(), "Demo Mode"
+
+    def generate_junit_tests_stream(self, java_code, class_name=None):
+        """Yield Deepseek-V2 output fragments as they decode (demo tests if V2 is unavailable)"""
+        if not class_name:
+            class_name = self._extract_class_name(java_code)
+        
+        if not self.deepseek_v2_available:
+            logger.warning("⚠️  Deepseek-V2 not available for streaming, using demo tests.")
+            yield self._generate_demo_tests(java_code, class_name), "Demo Mode"
+            return
+        
+        if self._input_too_large(java_code, "deepseek-v2"):
+            yield self._generate_demo_tests(java_code, class_name), "Demo Mode (input too large)"
+            return
+        
+        prompt = self._build_prompt(java_code)
+        logger.info(f"📡 Streaming for {class_name} using DEEPSEEK-V2 (prompt: {len(prompt)} chars)")
+        # Same admission limit and parallel slots as non-streaming calls
+        with self.scheduler.stream_slot():
+            for token in self.stream_with_deepseek_v2(prompt, self.max_tokens):
+                yield token, "Deepseek-Coder-V2:16b"
+
+    def _input_too_large(self, java_code, model_type):
+        """True when the prompt would leave less than min_output_tokens of the model's context"""
+        n_ctx = self.deepseek_6b_n_ctx if model_type == "deepseek-6b" else self.ollama_num_ctx
+        approx_tokens = len(java_code) // 3
+        if approx_tokens + self.prompt_overhead_tokens + self.min_output_tokens > n_ctx:
+            logger.warning(f"⚠️  Input too large for {model_type} (~{approx_tokens} tokens, context {n_ctx}). Using demo tests.")
+            return True
+        return False
+
+    def _build_prompt(self, java_code):
+        """Wrap the Java source in the pre-split prompt template"""
+        return "".join((self.prompt_prefix, java_code, self.prompt_suffix))
+
+    def _cache_key(self, java_code, class_name, model_type):
+        """Digest the request inputs without concatenating them"""
+        hasher = content_hasher(java_code.encode())
+        hasher.update(b'\0' + str(class_name).encode())
+        hasher.update(b'\0' + model_type.encode())
+        return hasher.digest()
+
+    def _cache_get(self, cache_key):
+        """Look up the LRU cache, then Redis; a Redis hit is promoted into the LRU"""
+        with self.cache_lock:
+            cached = self.generation_cache.get(cache_key)
+            if cached is not None:
+                self.generation_cache.move_to_end(cache_key)
+                return cached
+        if self.redis_cache is None:
+            return None
+        try:
+            blob = self.redis_cache.get(b"junit:" + cache_key)
+        except redis.RedisError as e:
+            logger.warning(f"⚠️  Redis cache read failed: {str(e)}")
+            return None
+        if blob is None:
+            return None
+        cached = tuple(json_loads(zlib.decompress(blob)))
+        self._cache_put(cache_key, cached, write_through=False)
+        return cached
+
+    def _cache_put(self, cache_key, value, write_through=True):
+        """Insert into the LRU cache, evicting the oldest entry when full"""
+        with self.cache_lock:
+            self.generation_cache[cache_key] = value
+            self.generation_cache.move_to_end(cache_key)
+            while len(self.generation_cache) > self.max_cache_size:
+                self.generation_cache.popitem(last=False)
+        if write_through and self.redis_cache is not None:
+            try:
+                self.redis_cache.setex(b"junit:" + cache_key, self.redis_ttl_seconds,
+                                       zlib.compress(json_dumps(value).encode()))
+            except redis.RedisError as e:
+                logger.warning(f"⚠️  Redis cache write failed: {str(e)}")
+
+    def clear_cache(self):
+        """Empty the LRU cache and any shared Redis entries; returns the number removed"""
+        with self.cache_lock:
+            removed = len(self.generation_cache)
+            self.generation_cache.clear()
+        if self.redis_cache is not None:
+            keys = list(self.redis_cache.scan_iter(match=b"junit:*", count=500))
+            if keys:
+                removed += self.redis_cache.delete(*keys)
+        return removed
 
     def _validate_generated_code(self, code, class_name):
         """Validate the generated test code with detailed logging."""
@@ -319,13 +787,12 @@ EOF"""
             logger.error(f"❌ Exception during code validation: {str(e)}")
             return False
 
-    def _generate_demo_tests(self, java_code, class_name):
+    def _generate_demo_tests(self, java_code, class_name, methods=None):
         """High-quality demo tests when model fails"""
         logger.info(f"--- Generating Demo Fallback Tests for {class_name} ---")
-        if not class_name:
-            class_name = self._extract_class_name(java_code)
-        
-        methods = self._extract_methods(java_code)
+        if methods is None:
+            parsed_class_name, methods = self._parse_java(java_code)
+            class_name = class_name or parsed_class_name
         
         test_methods = []
         for method in methods[:3]:
@@ -367,7 +834,7 @@ public class {class_name}Test {{
         """Extract class name from Java code"""
         logger.info("--- Starting Class Name Extraction ---")
         try:
-            match = re.search(r'public\s+(?:final\s+)?class\s+(\w+)', java_code)
+            match = CLASS_NAME_RE.search(java_code)
             if match:
                 class_name = match.group(1)
                 logger.info(f"✅ Found class name via regex: {class_name}")
@@ -389,22 +856,20 @@ public class {class_name}Test {{
         logger.error("❌ Could not find class name, falling back to 'TestClass'")
         return "TestClass"
 
-    def _extract_methods(self, java_code):
-        """Extract method signatures from Java code using a robust regex that handles annotations."""
-        logger.info("--- Starting Method Extraction ---")
+    def _parse_java(self, java_code):
+        """Extract the class name and public method names (tree-sitter when available, else regex)."""
+        logger.info("--- Starting Java Parse ---")
+        class_name = None
         methods = []
         try:
-            import re
-            # Regex to find public methods, ignoring annotations and handling multi-line params.
-            pattern = re.compile(
-                r'public\s+(?:static\s+)?'  # Modifier
-                r'[\w\<\>\[\]\.,\s]+?\s+'  # Non-greedy return type
-                r'(\w+)\s*'  # Method Name (the only capture group)
-                r'\([\s\S]*?\)\s*'  # Parameters (multi-line)
-                r'(?:throws\s+[\w\.,\s]+)?\s*{'
-            )
-            matches = pattern.findall(java_code)
-            logger.info(f"Found {len(matches)} potential public methods using regex.")
+            if JAVA_LANGUAGE is not None:
+                # One linear-time parse for both; no regex backtracking on nested generics
+                class_name, matches = _parse_java_tree(java_code)
+                logger.info(f"Found class {class_name} and {len(matches)} public methods using tree-sitter.")
+            else:
+                # Regex to find public methods, ignoring annotations and handling multi-line params.
+                matches = PUBLIC_METHOD_RE.findall(java_code)
+                logger.info(f"Found {len(matches)} potential public methods using regex.")
             
             for method_name in matches:
                 if method_name not in ['class', 'interface', 'enum']:
@@ -418,33 +883,31 @@ public class {class_name}Test {{
         except Exception as e:
             logger.error(f"❌ Exception during method extraction: {str(e)}")
         
-        logger.info("--- Finished Method Extraction ---")
-        return methods[:5]  # Max 5 methods
+        if class_name is None:
+            class_name = self._extract_class_name(java_code)
+        logger.info("--- Finished Java Parse ---")
+        return class_name, methods[:5]  # Max 5 methods
 
     def _clean_generated_code(self, generated_text, class_name):
         """Clean and format generated code by extracting the final Java code block."""
         logger.info("--- Starting Code Cleaning ---")
-        log_text = generated_text.replace('\n', ' ')[:300]
+        log_text = generated_text[:300].replace('\n', ' ')
         logger.info(f"Raw generated text (first 300 chars): {log_text}")
         try:
-            # Find the last occurrence of a Java code block.
+            # Take the last Java code block.
             # This is more robust if the model adds introductory text with examples.
-            last_code_block_start = generated_text.rfind("```java")
-            if last_code_block_start != -1:
-                # Find the end of that block
-                end_block = generated_text.find("```", last_code_block_start + 7)
-                if end_block != -1:
-                    code = generated_text[last_code_block_start + 7 : end_block]
-                    logger.info("✅ Extracted final Java code block from response.")
-                    return code.strip()
+            code_blocks = JAVA_CODE_BLOCK_RE.findall(generated_text)
+            if code_blocks:
+                logger.info("✅ Extracted final Java code block from response.")
+                return code_blocks[-1].strip()
 
             logger.warning("⚠️  Could not find a '```java ... ```' block. Falling back to other methods.")
             
             # Fallback for when the model doesn't use markdown fences
-            import_pos = generated_text.find("import ")
-            if import_pos != -1:
+            import_match = IMPORT_LINE_RE.search(generated_text)
+            if import_match:
                 logger.info("✅ Found 'import' statement, trimming preceding text.")
-                return generated_text[import_pos:].strip()
+                return generated_text[import_match.start():].strip()
 
             logger.warning("⚠️  No Java code block or 'import' statement found. Returning raw text for validation.")
             return generated_text.strip()
@@ -456,7 +919,7 @@ public class {class_name}Test {{
     def get_system_info(self):
         """Get current system status"""
         mem = psutil.virtual_memory()
-        cpu_percent = psutil.cpu_percent(interval=0.1)
+        cpu_percent = self.cpu_percent
         
         return {
             "total_memory_gb": round(mem.total / (1024**3), 2),
@@ -474,7 +937,7 @@ generator = DeepSeekV2Generator()
 @app.route('/health', methods=['GET'])
 def health():
     """Health check with multi-model system info"""
-    # Check Ollama status on health check
+    # Cached probe result - refreshed in the background, never blocks on Ollama
     generator.check_deepseek_v2_status()
     
     return jsonify({
@@ -568,15 +1031,55 @@ def generate():
             "system": generator.get_system_info()
         }), 200
         
+    except ServerBusyError as e:
+        logger.warning(f"⚠️  Rejecting request: {str(e)}")
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logger.error(f"❌ Top-level generation error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/generate-stream', methods=['POST'])
+def generate_stream():
+    """Stream JUnit tests as Server-Sent Events, one event per decoded fragment"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "No JSON data provided"}), 400
+    
+    java_code = data.get('prompt', '').strip()
+    class_name = data.get('className')
+    
+    if not java_code:
+        return jsonify({"error": "No Java code provided"}), 400
+    
+    generator.check_deepseek_v2_status()
+    
+    # Reject before the 200 headers go out; the stream itself re-checks when it takes a slot
+    try:
+        generator.scheduler.check_capacity()
+    except ServerBusyError as e:
+        logger.warning(f"⚠️  Rejecting stream: {str(e)}")
+        return jsonify({"error": str(e)}), 503
+    
+    def events():
+        start_time = time.time()
+        model_name = None
+        try:
+            for token, model_name in generator.generate_junit_tests_stream(java_code, class_name):
+                yield f"data: {json_dumps({'token': token})}\n\n"
+        except Exception as e:
+            logger.error(f"❌ Streaming generation error: {str(e)}")
+            yield f"event: error\ndata: {json_dumps({'error': str(e)})}\n\n"
+            return
+        done = {"model_used": model_name, "generation_time_seconds": round(time.time() - start_time, 2)}
+        yield f"event: done\ndata: {json_dumps(done)}\n\n"
+    
+    # Output is not cleaned/validated here - use /generate for the checked result
+    return Response(stream_with_context(events()), mimetype='text/event-stream')
+
 @app.route('/clear-cache', methods=['POST'])
 def clear_cache():
     """Clear generation cache"""
-    cache_size = len(generator.generation_cache)
-    generator.generation_cache.clear()
+    cache_size = generator.clear_cache()
     logger.info(f"Cache cleared. Removed {cache_size} items.")
     return jsonify({ "status": "success", "message": f"Cleared {cache_size} cached items" }), 200
 
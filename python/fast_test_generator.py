@@ -2,15 +2,49 @@
 """
 Fast JUnit Test Generator - Optimized for Speed
 Multiple approaches for fast test generation
+
+Production: serve with gunicorn instead of the Flask development server.
+The model is loaded per process (by /initialize-model, or on import from
+MODEL_PATH when PRELOAD_MODEL=1), so keep one worker and scale with threads
+(model calls are serialized by a lock, template and cache hits run
+concurrently):
+  PRELOAD_MODEL=1 gunicorn -w 1 --threads 16 --timeout 120 -b 0.0.0.0:8082 fast_test_generator:app
 """
 
 import argparse
 import json
 import logging
+import os
+import platform
+import queue
+import re
+import sys
 import threading
 import time
-from flask import Flask, request, jsonify
-from concurrent.futures import ThreadPoolExecutor
+from string import Template
+from collections import OrderedDict
+from concurrent.futures import Future
+from flask import Flask, Response, request, jsonify
+
+try:
+    import orjson
+    from flask.json.provider import JSONProvider
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# RE2 (linear-time DFA) for scanning request sources when installed, stdlib re otherwise.
+# Patterns below stay within the RE2 subset and use inline flags, which both accept.
+try:
+    import re2 as source_re
+except ImportError:
+    source_re = re
+
+# BLAKE3 when installed, otherwise stdlib BLAKE2 - both take bytes and expose update()/digest()
+try:
+    from blake3 import blake3 as content_hasher
+except ImportError:
+    from hashlib import blake2b as content_hasher
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,11 +52,100 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+if ORJSON_AVAILABLE:
+    class ORJSONProvider(JSONProvider):
+        """Flask JSON provider backed by orjson"""
+        
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode()
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+    
+    app.json = ORJSONProvider(app)
+
+CLASS_NAME_RE = source_re.compile(r'\bpublic\s+(?:(?:final|abstract|static)\s+)*class\s+([A-Za-z_$][\w$]*)')
+
+# llama-cpp CPU tuning, overridable per deployment
+LLAMA_N_THREADS = int(os.environ.get("LLAMA_N_THREADS", min(os.cpu_count() or 4, 16)))
+LLAMA_N_BATCH = int(os.environ.get("LLAMA_N_BATCH", 2048))
+LLAMA_N_UBATCH = int(os.environ.get("LLAMA_N_UBATCH", 512))
+
+# Preferred quantization per CPU: llama.cpp repacks Q4_0 into interleaved 8x8 blocks at
+# load on ARM (i8mm/SVE kernels, e.g. Graviton), while K-quants are fastest on x86
+MODEL_DIR = "/home/adminuser/models"
+PREFERRED_MODEL_FILES = {
+    "aarch64": "codellama-13b-instruct.Q4_0.gguf",
+    "arm64": "codellama-13b-instruct.Q4_0.gguf",
+}
+DEFAULT_MODEL_PATH = os.path.join(MODEL_DIR, "codellama-13b-instruct.Q4_K_M.gguf")
+if platform.machine() in PREFERRED_MODEL_FILES:
+    preferred_path = os.path.join(MODEL_DIR, PREFERRED_MODEL_FILES[platform.machine()])
+    # Only switch when the preferred file is actually installed on this host
+    if os.path.exists(preferred_path):
+        DEFAULT_MODEL_PATH = preferred_path
+logger.info(f"Default model file: {DEFAULT_MODEL_PATH}")
+
+# Template routing hints, matched case-insensitively without lowercasing the source
+# Arithmetic names only count as method names/calls, so "address" or "padding" no longer match
+CALCULATOR_HINT_RE = source_re.compile(r'(?i)calculator|\b(?:add|subtract|multiply|divide)\s*\(')
+UTILS_HINT_RE = source_re.compile(r'(?i)util|helper')
+
+class PromptBatcher:
+    """Runs model calls on one thread; identical prompts arriving within a window share one completion"""
+    
+    def __init__(self, generate_fn, max_batch=8, window_seconds=0.01):
+        self.generate_fn = generate_fn
+        self.max_batch = max_batch
+        self.window_seconds = window_seconds
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+    
+    def submit(self, prompt):
+        """Queue a prompt and block until its completion is ready"""
+        future = Future()
+        self.queue.put((prompt, future))
+        return future.result()
+    
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            # Collect whatever else arrives within the window
+            deadline = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            waiters = {}
+            for prompt, future in batch:
+                waiters.setdefault(prompt, []).append(future)
+            
+            for prompt, futures in waiters.items():
+                try:
+                    result = self.generate_fn(prompt)
+                except Exception as e:
+                    for future in futures:
+                        future.set_exception(e)
+                else:
+                    for future in futures:
+                        future.set_result(result)
+
+
 class FastTestGenerator:
     def __init__(self):
         self.model = None
-        self.generation_cache = {}
-        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.generation_cache = OrderedDict()  # LRU, bounded by max_cache_size
+        self.max_cache_size = 1024
+        self.cache_lock = threading.Lock()  # Writers only; reads stay lock-free
+        self.model_lock = threading.Lock()  # llama-cpp contexts are not thread-safe
+        self.batcher = PromptBatcher(self._complete)
+        # Token ids per prompt; the prompt depends only on the class name, so repeats skip tokenization
+        self.prompt_token_cache = {}
         
         # Optimized settings for speed
         self.max_tokens = 512  # Reduced for faster generation
@@ -33,9 +156,14 @@ class FastTestGenerator:
         # Template cache for instant responses
         self.template_cache = {
             "calculator": self._get_calculator_template(),
-            "basic": self._get_basic_template(),
-            "utils": self._get_utils_template()
+            "basic": Template(self._get_basic_template()),
+            "utils": Template(self._get_utils_template())
         }
+        # Rendered basic/utils templates keyed by (kind, class_name)
+        self.rendered_template_cache = {}
+        # Pre-serialized /generate JSON bodies for template results; only the timing is patched in
+        self.template_envelopes = {}
+        self._add_template_envelope(self.template_cache["calculator"])
     
     def _get_calculator_template(self):
         return '''import org.junit.jupiter.api.Test;
@@ -88,12 +216,12 @@ class CalculatorTest {
 import org.junit.jupiter.api.BeforeEach;
 import static org.junit.jupiter.api.Assertions.*;
 
-class {class_name}Test {
-    private {class_name} testObject;
+class ${class_name}Test {
+    private $class_name testObject;
     
     @BeforeEach
     void setUp() {
-        testObject = new {class_name}();
+        testObject = new $class_name();
     }
     
     @Test
@@ -122,21 +250,21 @@ import org.junit.jupiter.api.BeforeEach;
 import org.junit.jupiter.api.DisplayName;
 import static org.junit.jupiter.api.Assertions.*;
 
-@DisplayName("{class_name} Tests")
-class {class_name}Test {
+@DisplayName("$class_name Tests")
+class ${class_name}Test {
     
-    private {class_name} {instance_name};
+    private $class_name $instance_name;
     
     @BeforeEach
     void setUp() {
-        {instance_name} = new {class_name}();
+        $instance_name = new $class_name();
     }
     
     @Test
     @DisplayName("Should handle valid inputs correctly")
     void testValidInputs() {
         // Test with valid inputs
-        assertNotNull({instance_name});
+        assertNotNull($instance_name);
     }
     
     @Test
@@ -160,17 +288,22 @@ class {class_name}Test {
                 from llama_cpp import Llama
                 logger.info("Attempting to load optimized CodeLlama model...")
                 
-                self.model = Llama(
-                    model_path=model_path or "/home/adminuser/models/codellama-13b-instruct.Q4_K_M.gguf",
+                model = Llama(
+                    model_path=model_path or DEFAULT_MODEL_PATH,
                     n_ctx=2048,  # Reduced context for speed
-                    n_threads=-1,  # Use all available threads
+                    n_threads=LLAMA_N_THREADS,  # Explicit count scales better than -1
+                    n_threads_batch=LLAMA_N_THREADS,
                     n_gpu_layers=0,  # CPU only
                     verbose=False,
                     use_mmap=True,  # Memory mapping for faster loading
-                    use_mlock=True,  # Lock memory for performance
-                    n_batch=512,  # Batch size optimization
-                    low_vram=True  # Low VRAM mode for better CPU performance
+                    use_mlock=False,
+                    n_batch=LLAMA_N_BATCH,  # Whole prompt in one logical batch
+                    n_ubatch=LLAMA_N_UBATCH
                 )
+                # Swap under the lock so an in-flight generation finishes on the old model
+                with self.model_lock:
+                    self.model = model
+                    self.prompt_token_cache.clear()
                 logger.info("CodeLlama model loaded with optimizations!")
                 return True
                 
@@ -189,21 +322,25 @@ class {class_name}Test {
         # Extract class name if not provided
         if not class_name:
             class_name = self._extract_class_name(java_code)
+        else:
+            class_name = sys.intern(class_name)
         
         # Check cache first
-        cache_key = hash(java_code)
-        if cache_key in self.generation_cache:
+        cache_key = self._cache_key(java_code, class_name)
+        cached = self.generation_cache.get(cache_key)
+        if cached is not None:
+            try:
+                self.generation_cache.move_to_end(cache_key)
+            except KeyError:
+                pass  # Evicted by a concurrent writer after the get - still a valid hit
             logger.info("Returning cached result")
-            return self.generation_cache[cache_key]
+            return cached
         
         # Smart template selection based on code content
-        if "calculator" in java_code.lower() or any(op in java_code.lower() for op in ["add", "subtract", "multiply", "divide"]):
+        if CALCULATOR_HINT_RE.search(java_code):
             result = self.template_cache["calculator"]
-        elif "util" in java_code.lower() or "helper" in java_code.lower():
-            result = self.template_cache["utils"].format(
-                class_name=class_name,
-                instance_name=class_name.lower()
-            )
+        elif UTILS_HINT_RE.search(java_code):
+            result = self._render_template("utils", class_name)
         else:
             # Try LLM generation with timeout
             if self.model:
@@ -211,50 +348,106 @@ class {class_name}Test {
                     result = self._generate_with_model_fast(java_code, class_name)
                 except Exception as e:
                     logger.warning(f"LLM generation failed: {e}, using template")
-                    result = self.template_cache["basic"].format(class_name=class_name)
+                    result = self._render_template("basic", class_name)
             else:
-                result = self.template_cache["basic"].format(class_name=class_name)
+                result = self._render_template("basic", class_name)
         
         # Cache the result
-        self.generation_cache[cache_key] = result
+        self._cache_put(cache_key, result)
         return result
 
+    def warm_templates(self, class_names=("Calculator", "Utils", "Helper")):
+        """Pre-render the basic/utils templates for common class names"""
+        for class_name in class_names:
+            for kind in ("basic", "utils"):
+                self._render_template(kind, sys.intern(class_name))
+
+    def _render_template(self, kind, class_name):
+        """Substitute the class name into a template once per (kind, class_name)"""
+        key = (kind, class_name)
+        rendered = self.rendered_template_cache.get(key)
+        if rendered is None:
+            if len(self.rendered_template_cache) >= self.max_cache_size:
+                self.rendered_template_cache.clear()
+            rendered = self.template_cache[kind].substitute(
+                class_name=class_name,
+                instance_name=class_name.lower()
+            )
+            self.rendered_template_cache[key] = rendered
+            self._add_template_envelope(rendered)
+        return rendered
+
+    def _add_template_envelope(self, template):
+        """Serialize the /generate response around a fixed template once"""
+        if len(self.template_envelopes) >= self.max_cache_size:
+            self.template_envelopes.clear()
+        prefix = b'{"method":"optimized_hybrid","response":' + json.dumps(template).encode() + b',"generation_time_ms":'
+        self.template_envelopes[template] = prefix
+
+    def _cache_key(self, java_code, class_name):
+        """Stable content digest of the request inputs"""
+        hasher = content_hasher(java_code.encode())
+        hasher.update(b'\0' + class_name.encode())
+        return hasher.digest()
+
+    def _cache_put(self, cache_key, value):
+        """Insert into the LRU cache, evicting the oldest entry when full"""
+        with self.cache_lock:
+            self.generation_cache[cache_key] = value
+            self.generation_cache.move_to_end(cache_key)
+            while len(self.generation_cache) > self.max_cache_size:
+                self.generation_cache.popitem(last=False)
+
     def _generate_with_model_fast(self, java_code, class_name):
         """Fast LLM generation with aggressive optimizations"""
         
         # Ultra-short prompt for speed
         prompt = f"[INST] Generate JUnit test for: {class_name} [/INST]\n```java"
-        
+        return self.batcher.submit(prompt)
+
+    def _complete(self, prompt):
+        """Run one completion; called only from the batcher thread"""
         # Ultra-fast generation settings
-        output = self.model(
-            prompt,
-            max_tokens=256,  # Very limited for speed
-            temperature=0.05,  # Very deterministic
-            top_p=0.8,
-            repeat_penalty=1.1,
-            stop=["```", "</s>", "class "],
-            echo=False
-        )
+        with self.model_lock:
+            tokens = self.prompt_token_cache.get(prompt)
+            if tokens is None:
+                if len(self.prompt_token_cache) >= self.max_cache_size:
+                    self.prompt_token_cache.clear()
+                tokens = self.model.tokenize(prompt.encode())
+                self.prompt_token_cache[prompt] = tokens
+            output = self.model(
+                tokens,
+                max_tokens=256,  # Very limited for speed
+                temperature=0.05,  # Very deterministic
+                top_p=0.8,
+                repeat_penalty=1.1,
+                stop=["```", "</s>", "class "],
+                echo=False
+            )
         
         return output['choices'][0]['text'].strip()
 
     def _extract_class_name(self, java_code):
         """Extract class name from Java code"""
-        try:
-            lines = java_code.split('\n')
-            for line in lines:
-                if 'class ' in line and 'public' in line:
-                    parts = line.split('class ')
-                    if len(parts) > 1:
-                        class_part = parts[1].split(' ')[0].split('{')[0].strip()
-                        return class_part
-            return "TestClass"
-        except:
-            return "TestClass"
+        match = CLASS_NAME_RE.search(java_code)
+        # Interned so rendered_template_cache lookups hit on pointer equality
+        return sys.intern(match.group(1)) if match else "TestClass"
 
 # Global generator instance
 fast_generator = FastTestGenerator()
 
+
+def preload(model_path=None):
+    """Warm template caches and load the model so the first request doesn't pay for it"""
+    fast_generator.warm_templates()
+    fast_generator.initialize_model_fast(model_path or os.environ.get("MODEL_PATH"))
+
+
+# Opt-in: with PRELOAD_MODEL=1, gunicorn workers start loading as soon as they import the app
+PRELOAD_MODEL = os.environ.get("PRELOAD_MODEL", "0") == "1"
+if PRELOAD_MODEL and __name__ != '__main__':
+    threading.Thread(target=preload, daemon=True).start()
+
 @app.route('/initialize-model', methods=['POST'])
 def initialize_model():
     """Initialize model with speed optimizations"""
@@ -275,7 +468,7 @@ def initialize_model():
 def generate():
     """Fast test generation endpoint"""
     try:
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         
         # Better JSON handling
         try:
@@ -296,12 +489,18 @@ def generate():
         # Generate tests quickly
         result = fast_generator.generate_tests_fast(java_code, class_name)
         
-        generation_time = time.time() - start_time
-        logger.info(f"Test generation completed in {generation_time:.2f} seconds")
+        generation_time_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
+        logger.info("Test generation completed in %d ms", generation_time_ms)
+        
+        # Template results skip JSON encoding of the multi-kB test body
+        envelope = fast_generator.template_envelopes.get(result)
+        if envelope is not None:
+            body = envelope + str(generation_time_ms).encode() + b'}'
+            return Response(body, mimetype='application/json')
         
         return jsonify({
             "response": result,
-            "generation_time_ms": int(generation_time * 1000),
+            "generation_time_ms": generation_time_ms,
             "method": "optimized_hybrid"
         }), 200
         
@@ -309,37 +508,41 @@ def generate():
         logger.error(f"Generation error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# /health fields that never change over the process lifetime
+HEALTH_STATIC_FIELDS = {
+    "status": "healthy",
+    "model_type": "Fast Hybrid Generator",
+    "template_cache": len(fast_generator.template_cache),
+    "max_tokens": fast_generator.max_tokens,
+    "expected_response_time": "< 5 seconds",
+    "optimization_level": "maximum"
+}
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check with performance info"""
-    return jsonify({
-        "status": "healthy",
-        "model_loaded": fast_generator.model is not None,
-        "model_type": "Fast Hybrid Generator",
-        "cache_size": len(fast_generator.generation_cache),
-        "template_cache": len(fast_generator.template_cache),
-        "max_tokens": fast_generator.max_tokens,
-        "expected_response_time": "< 5 seconds",
-        "optimization_level": "maximum"
-    }), 200
+    health_info = HEALTH_STATIC_FIELDS.copy()
+    health_info["model_loaded"] = fast_generator.model is not None
+    health_info["cache_size"] = len(fast_generator.generation_cache)
+    return jsonify(health_info), 200
 
 @app.route('/benchmark', methods=['GET'])
 def benchmark():
     """Quick benchmark test"""
     try:
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         
         # Test with sample code
         sample_code = "public class Calculator { public int add(int a, int b) { return a + b; } }"
         result = fast_generator.generate_tests_fast(sample_code, "Calculator")
         
-        benchmark_time = time.time() - start_time
+        benchmark_time_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
         
         return jsonify({
-            "benchmark_time_ms": int(benchmark_time * 1000),
+            "benchmark_time_ms": benchmark_time_ms,
             "test_length": len(result),
             "status": "success",
-            "performance_rating": "excellent" if benchmark_time < 2 else "good" if benchmark_time < 5 else "slow"
+            "performance_rating": "excellent" if benchmark_time_ms < 2000 else "good" if benchmark_time_ms < 5000 else "slow"
         }), 200
         
     except Exception as e:
@@ -356,4 +559,8 @@ if __name__ == '__main__':
     print("⚡ Optimized for sub-5-second response times")
     print("🎯 Hybrid approach: Templates + Smart LLM usage")
     
+    # An explicit --model-path also opts in to loading at startup
+    if PRELOAD_MODEL or args.model_path:
+        threading.Thread(target=preload, args=(args.model_path,), daemon=True).start()
+    
     app.run(host=args.host, port=args.port, debug=False, threaded=True) 
\ No newline at end of file
@@ -2,16 +2,53 @@
 """
 Intelligent Test Generator for Large Files
 Uses chunking strategies and code analysis for complex files
+
+Production: serve with gunicorn instead of the Flask development server.
+On GPU keep one worker so the model is loaded once (a CUDA context cannot be
+forked, and one process avoids VRAM contention); request threads block on
+the chunk scheduler while /health, cache hits and template fast paths keep
+being served:
+  gunicorn -w 1 --threads 16 --timeout 600 -b 0.0.0.0:8080 intelligent_test_generator:app
+On CPU, load the model once in the master with PRELOAD_MODEL=1 (GGUF from
+MODEL_PATH, CodeT5+ otherwise) and fork workers that share its pages:
+  PRELOAD_MODEL=1 WEB_CONCURRENCY=4 gunicorn --preload --threads 8 --timeout 600 -b 0.0.0.0:8080 intelligent_test_generator:app
+gunicorn takes its worker count from WEB_CONCURRENCY, and llama.cpp splits the
+cores across the same number of workers so they don't oversubscribe the CPU.
 """
 
 import argparse
 import json
 import logging
+import os
 import torch
 import re
 import ast
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 from flask import Flask, request, jsonify
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+
+# GGUF backend via llama.cpp (preferred when a model_path is given)
+try:
+    from llama_cpp import Llama
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+
+# FlashAttention-2 kernels for transformers models on GPU (SDPA otherwise)
+try:
+    import flash_attn
+    FLASH_ATTN_AVAILABLE = True
+except ImportError:
+    FLASH_ATTN_AVAILABLE = False
+
+# BLAKE3 when installed, otherwise stdlib BLAKE2 - both take bytes and expose digest()
+try:
+    from blake3 import blake3 as content_hasher
+except ImportError:
+    from hashlib import blake2b as content_hasher
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -19,15 +56,149 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Opt-in torch.compile of the transformers model (loads unquantized, since bitsandbytes kernels don't trace)
+TORCH_COMPILE = os.environ.get('TORCH_COMPILE', '0') == '1'
+# Prompt lengths are padded to multiples of this so compiled graphs see a few fixed shapes
+PROMPT_LENGTH_BUCKET = 256
+# llama.cpp threads per process: the cores divided among the gunicorn workers (WEB_CONCURRENCY)
+LLAMA_N_THREADS = int(os.environ.get(
+    'LLAMA_N_THREADS',
+    max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', '1')))
+))
+
+# RE2 (linear-time DFA) for Java analysis when installed, stdlib re otherwise.
+# The analysis patterns avoid lookaround and backreferences, so both engines accept them.
+try:
+    import re2 as source_re
+except ImportError:
+    source_re = re
+
+# Java analysis patterns, compiled once
+PACKAGE_RE = source_re.compile(r'package\s+([^;]+);')
+IMPORT_RE = source_re.compile(r'import\s+(?:static\s+)?([^;]+);')
+CLASS_RE = source_re.compile(r'(?:public|private|protected)?\s*(?:static\s+)?(?:final\s+)?(?:abstract\s+)?class\s+(\w+)(?:\s+extends\s+(\w+))?(?:\s+implements\s+([^{]+))?\s*\{')
+INTERFACE_RE = source_re.compile(r'(?:public|private|protected)?\s*interface\s+(\w+)(?:\s+extends\s+([^{]+))?\s*\{')
+METHOD_RE = source_re.compile(
+    r'(?P<vis>public|private|protected)\s+(?P<static>static\s+)?(?:final\s+)?(?:synchronized\s+)?(?P<abstract>abstract\s+)?'
+    r'(?:<[^>]+>\s+)?(?P<ret>\w+(?:<[^>]+>)?)\s+(?P<name>\w+)\s*\((?P<params>[^)]*)\)(?:\s+throws\s+[^{]+)?\s*\{'
+)
+
+# Complexity indicators in one alternation; the matched group name selects the weight
+COMPLEXITY_RE = source_re.compile(
+    r'\b(?P<ctrl>if|else|switch)\b'
+    r'|\b(?P<loop>for|while|do)\b'
+    r'|\b(?P<exc>try|catch|finally)\b'
+    r'|\b(?P<thr>throw|throws)\b'
+    r'|(?P<ann>@(\w+))'
+    r'|\b(?P<sync>synchronized|volatile)\b'
+)
+COMPLEXITY_WEIGHTS = {'ctrl': 2, 'loop': 3, 'exc': 2, 'thr': 1, 'ann': 1, 'sync': 2}
+
+# Files below both limits skip the model; templates cover them equally well
+FAST_PATH_MAX_COMPLEXITY = 20
+FAST_PATH_MAX_LINES = 200
+
+# Decoding ends at the close of a top-level test class or a closing code fence
+STOP_SEQUENCES = ["\n}\n\n", "```"]
+
+# Static instructions go first so every chunk prompt shares the same token prefix
+CHUNK_PROMPT_PREFIX = """Generate comprehensive JUnit 5 test cases for the Java code chunk below.
+
+Requirements:
+1. Use JUnit 5 annotations
+2. Include Mockito for mocking
+3. Test all public methods
+4. Include edge cases and error scenarios
+5. Proper assertions
+
+"""
+
+class ChunkBatchScheduler:
+    """Single model thread that batches pending chunks from all in-flight requests"""
+    
+    def __init__(self, generate_fn, max_batch=8):
+        self.generate_fn = generate_fn
+        self.max_batch = max_batch
+        self._start()
+        # Threads don't survive fork (gunicorn --preload), so each worker starts its own
+        os.register_at_fork(after_in_child=self._start)
+    
+    def _start(self):
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+    
+    def submit(self, chunks):
+        """Queue chunks and block until each has a result (None when generation failed)"""
+        futures = []
+        for chunk in chunks:
+            future = Future()
+            self.queue.put((chunk, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+    
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            # Chunks queued while the previous batch was decoding join this one
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                results = self.generate_fn([chunk for chunk, _ in batch])
+            except Exception as e:
+                logger.error(f"Batch generation error: {str(e)}")
+                results = [None] * len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
 class IntelligentTestGenerator:
     def __init__(self):
         self.model = None
         self.tokenizer = None
         self.device = None
         self.max_context = 4096
+        self.max_input_length = 2048  # Prompt tokens per chunk on the transformers backend
+        self.backend = None  # "llama_cpp" or "transformers"
+        # Reused pinned-host/GPU buffers for input_ids and attention_mask (CUDA only, allocated on first batch)
+        self.input_buffers = None
+        self.scheduler = ChunkBatchScheduler(self._generate_batch_with_model)
+        # LRU caches keyed by content digest, bounded by max_cache_size
+        self.generation_cache = OrderedDict()
+        self.analysis_cache = OrderedDict()
+        self.max_cache_size = 128
+        self.cache_lock = threading.Lock()
     
-    def initialize_model(self):
-        """Initialize a reliable code generation model"""
+    def initialize_model(self, model_path=None):
+        """Initialize a reliable code generation model (GGUF via llama.cpp when model_path is given)"""
+        # Cached suites may have come from templates or a different model
+        with self.cache_lock:
+            self.generation_cache.clear()
+        
+        if model_path:
+            if LLAMA_CPP_AVAILABLE:
+                try:
+                    logger.info(f"Loading GGUF model via llama.cpp: {model_path}")
+                    self.model = Llama(
+                        model_path=model_path,
+                        n_ctx=self.max_context,
+                        n_threads=LLAMA_N_THREADS,
+                        n_batch=512,
+                        logits_all=False,
+                        verbose=False
+                    )
+                    self.tokenizer = None
+                    self.backend = "llama_cpp"
+                    logger.info("GGUF model loaded successfully")
+                    return True
+                except Exception as e:
+                    logger.error(f"Failed to load GGUF model: {str(e)}")
+            else:
+                logger.warning("llama-cpp-python not available, falling back to transformers")
+        
+        self.backend = "transformers"
         try:
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
             logger.info(f"Using device: {self.device}")
@@ -37,15 +208,37 @@ class IntelligentTestGenerator:
             logger.info(f"Loading model: {model_name}")
             
             self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                device_map="auto" if torch.cuda.is_available() else None,
-                trust_remote_code=True
-            )
+            if torch.cuda.is_available() and not TORCH_COMPILE:
+                # LLM.int8 weights halve the bytes streamed per decoded token
+                self.model = self._from_pretrained(
+                    AutoModelForCausalLM,
+                    model_name,
+                    quantization_config=BitsAndBytesConfig(load_in_8bit=True, llm_int8_threshold=6.0),
+                    torch_dtype=torch.float16,
+                    device_map="auto",
+                    trust_remote_code=True
+                )
+            elif TORCH_COMPILE:
+                self.model = self._from_pretrained(
+                    AutoModelForCausalLM,
+                    model_name,
+                    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+                    trust_remote_code=True
+                ).to(self.device)
+                self._compile_model()
+            else:
+                self.model = self._from_pretrained(
+                    AutoModelForCausalLM,
+                    model_name,
+                    torch_dtype=torch.float32,
+                    trust_remote_code=True
+                )
+                self.model = self._quantize_for_cpu(self.model.to(self.device))
             
-            if not torch.cuda.is_available():
-                self.model = self.model.to(self.device)
+            # Batched generation: decoder-only models need left padding and a pad token
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.tokenizer.padding_side = "left"
             
             logger.info("Model loaded successfully")
             return True
@@ -56,12 +249,12 @@ class IntelligentTestGenerator:
                 model_name = "Salesforce/codet5p-220m"
                 logger.info(f"Fallback to: {model_name}")
                 
-                from transformers import RobertaTokenizer, T5ForConditionalGeneration
-                self.tokenizer = RobertaTokenizer.from_pretrained(model_name)
-                self.model = T5ForConditionalGeneration.from_pretrained(model_name)
+                from transformers import RobertaTokenizerFast, T5ForConditionalGeneration
+                self.tokenizer = RobertaTokenizerFast.from_pretrained(model_name)
+                self.model = self._from_pretrained(T5ForConditionalGeneration, model_name)
                 
                 if not torch.cuda.is_available():
-                    self.model = self.model.to(self.device)
+                    self.model = self._quantize_for_cpu(self.model.to(self.device))
                 
                 logger.info("Fallback model loaded successfully")
                 return True
@@ -69,6 +262,34 @@ class IntelligentTestGenerator:
                 logger.error(f"Fallback failed: {str(fallback_error)}")
                 return False
     
+    def _from_pretrained(self, model_cls, model_name, **kwargs):
+        """Load with a fused attention kernel, retrying with the default attention if the model doesn't support it"""
+        if FLASH_ATTN_AVAILABLE and torch.cuda.is_available():
+            attn_implementation = "flash_attention_2"
+        else:
+            attn_implementation = "sdpa"
+        try:
+            return model_cls.from_pretrained(model_name, attn_implementation=attn_implementation, **kwargs)
+        except (ValueError, ImportError) as e:
+            logger.warning(f"{attn_implementation} attention unavailable, using default: {str(e)}")
+            return model_cls.from_pretrained(model_name, **kwargs)
+    
+    def _quantize_for_cpu(self, model):
+        """Dynamic INT8 quantization of Linear layers so CPU inference uses int8 GEMM kernels"""
+        try:
+            return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        except Exception as e:
+            logger.warning(f"INT8 quantization unavailable, using FP32: {str(e)}")
+            return model
+    
+    def _compile_model(self):
+        """Compile the forward pass; generate() stays on the module and calls the compiled forward"""
+        try:
+            self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead", dynamic=False)
+            logger.info("Model forward compiled with torch.compile")
+        except Exception as e:
+            logger.warning(f"torch.compile unavailable, running eager: {str(e)}")
+    
     def analyze_java_file(self, file_content):
         """Comprehensive Java file analysis"""
         analysis = {
@@ -80,24 +301,23 @@ class IntelligentTestGenerator:
             'package': None,
             'annotations': [],
             'complexity_score': 0,
-            'line_count': len(file_content.split('\n')),
+            'line_count': file_content.count('\n') + 1,
             'dependencies': set()
         }
         
         # Extract package
-        package_match = re.search(r'package\s+([^;]+);', file_content)
+        package_match = PACKAGE_RE.search(file_content)
         if package_match:
             analysis['package'] = package_match.group(1).strip()
         
         # Extract imports
-        imports = re.findall(r'import\s+(?:static\s+)?([^;]+);', file_content)
+        imports = IMPORT_RE.findall(file_content)
         analysis['imports'] = imports
         for imp in imports:
             analysis['dependencies'].add(imp.split('.')[0])
         
         # Extract classes with details
-        class_pattern = r'(?:public|private|protected)?\s*(?:static\s+)?(?:final\s+)?(?:abstract\s+)?class\s+(\w+)(?:\s+extends\s+(\w+))?(?:\s+implements\s+([^{]+))?\s*\{'
-        for match in re.finditer(class_pattern, file_content):
+        for match in CLASS_RE.finditer(file_content):
             class_info = {
                 'name': match.group(1),
                 'extends': match.group(2) if match.group(2) else None,
@@ -108,47 +328,31 @@ class IntelligentTestGenerator:
             analysis['classes'].append(class_info)
         
         # Extract interfaces
-        interface_pattern = r'(?:public|private|protected)?\s*interface\s+(\w+)(?:\s+extends\s+([^{]+))?\s*\{'
-        for match in re.finditer(interface_pattern, file_content):
+        for match in INTERFACE_RE.finditer(file_content):
             analysis['interfaces'].append({
                 'name': match.group(1),
                 'extends': [i.strip() for i in match.group(2).split(',')] if match.group(2) else []
             })
         
         # Extract methods with detailed information
-        method_pattern = r'((?:public|private|protected)\s+(?:static\s+)?(?:final\s+)?(?:synchronized\s+)?(?:abstract\s+)?(?:<[^>]+>\s+)?(\w+(?:<[^>]+>)?)\s+(\w+)\s*\(([^)]*)\)(?:\s+throws\s+[^{]+)?\s*\{)'
-        for match in re.finditer(method_pattern, file_content):
+        for match in METHOD_RE.finditer(file_content):
             method_info = {
-                'visibility': self._extract_visibility(match.group(1)),
-                'return_type': match.group(2),
-                'name': match.group(3),
-                'parameters': self._parse_parameters(match.group(4)),
+                'visibility': match.group('vis') or 'package',
+                'return_type': match.group('ret'),
+                'name': match.group('name'),
+                'parameters': self._parse_parameters(match.group('params')),
                 'full_signature': match.group(0),
                 'start_pos': match.start(),
-                'is_static': 'static' in match.group(1),
-                'is_abstract': 'abstract' in match.group(1)
+                'is_static': match.group('static') is not None,
+                'is_abstract': match.group('abstract') is not None
             }
             analysis['methods'].append(method_info)
         
-        # Calculate complexity score
-        analysis['complexity_score'] = self._calculate_complexity(file_content)
-        
-        # Extract annotations
-        analysis['annotations'] = re.findall(r'@(\w+)', file_content)
+        # Calculate complexity score; the same pass collects annotations
+        analysis['complexity_score'] = self._calculate_complexity(file_content, analysis['annotations'])
         
         return analysis
     
-    def _extract_visibility(self, method_signature):
-        """Extract visibility modifier"""
-        if 'public' in method_signature:
-            return 'public'
-        elif 'private' in method_signature:
-            return 'private'
-        elif 'protected' in method_signature:
-            return 'protected'
-        else:
-            return 'package'
-    
     def _parse_parameters(self, params_str):
         """Parse method parameters"""
         if not params_str.strip():
@@ -166,40 +370,39 @@ class IntelligentTestGenerator:
                     })
         return params
     
-    def _calculate_complexity(self, content):
-        """Calculate complexity score based on various factors"""
+    def _calculate_complexity(self, content, annotations=None):
+        """Calculate complexity score based on various factors, optionally appending annotation names"""
         score = 0
-        score += len(re.findall(r'\bif\b|\belse\b|\bswitch\b', content)) * 2
-        score += len(re.findall(r'\bfor\b|\bwhile\b|\bdo\b', content)) * 3
-        score += len(re.findall(r'\btry\b|\bcatch\b|\bfinally\b', content)) * 2
-        score += len(re.findall(r'\bthrow\b|\bthrows\b', content)) * 1
-        score += len(re.findall(r'@\w+', content)) * 1
-        score += len(re.findall(r'\bsynchronized\b|\bvolatile\b', content)) * 2
+        for match in COMPLEXITY_RE.finditer(content):
+            kind = match.lastgroup
+            score += COMPLEXITY_WEIGHTS[kind]
+            if kind == 'ann' and annotations is not None:
+                annotations.append(match.group(match.lastindex + 1))
         return score
     
     def chunk_by_methods(self, file_content, analysis, max_chunk_size=3000):
         """Intelligently chunk file by methods and classes"""
         chunks = []
-        lines = file_content.split('\n')
         
         # Sort methods by position
         methods = sorted(analysis['methods'], key=lambda m: m['start_pos'])
         classes = sorted(analysis['classes'], key=lambda c: c['start_pos'])
         
-        current_chunk = []
-        current_size = 0
-        chunk_metadata = []
-        
-        # Include imports and package in first chunk
-        imports_section = []
-        for i, line in enumerate(lines):
-            if line.strip().startswith('package') or line.strip().startswith('import') or not line.strip():
-                imports_section.append(line)
-            else:
+        # Include imports and package in first chunk; scan line offsets instead of splitting the file
+        line_start = 0
+        imports_end = None
+        while line_start <= len(file_content):
+            line_end = file_content.find('\n', line_start)
+            if line_end == -1:
+                line_end = len(file_content)
+            line = file_content[line_start:line_end].strip()
+            if not (line.startswith('package') or line.startswith('import') or not line):
                 break
+            imports_end = line_end
+            line_start = line_end + 1
         
-        if imports_section:
-            imports_text = '\n'.join(imports_section)
+        if imports_end is not None:
+            imports_text = file_content[:imports_end]
             chunks.append({
                 'content': imports_text,
                 'type': 'imports',
@@ -219,11 +422,10 @@ class IntelligentTestGenerator:
                     break
             
             class_end = next_class_start if next_class_start else len(file_content)
-            class_content = file_content[class_start:class_end]
             
-            if len(class_content) > max_chunk_size:
+            if class_end - class_start > max_chunk_size:
                 # Split large class into method chunks
-                method_chunks = self._chunk_class_by_methods(class_content, class_methods, max_chunk_size)
+                method_chunks = self._chunk_class_by_methods(file_content, class_start, class_end, class_methods, max_chunk_size)
                 for chunk in method_chunks:
                     chunks.append({
                         'content': chunk['content'],
@@ -235,7 +437,7 @@ class IntelligentTestGenerator:
                     })
             else:
                 chunks.append({
-                    'content': class_content,
+                    'content': file_content[class_start:class_end],
                     'type': 'class',
                     'metadata': {
                         'class_name': class_info['name'],
@@ -245,45 +447,47 @@ class IntelligentTestGenerator:
         
         return chunks
     
-    def _chunk_class_by_methods(self, class_content, methods, max_size):
-        """Chunk a large class by its methods"""
+    def _chunk_class_by_methods(self, file_content, class_start, class_end, methods, max_size):
+        """Chunk a large class, given by its span in file_content, by its methods"""
         chunks = []
-        lines = class_content.split('\n')
-        
-        # Find class header
-        class_header = []
-        brace_count = 0
-        for i, line in enumerate(lines):
-            class_header.append(line)
-            if '{' in line:
-                brace_count += line.count('{')
-                if brace_count > 0:
-                    break
         
-        current_chunk = class_header[:]
+        # Class header runs through the first line containing an opening brace
+        header_end = class_end
+        brace_pos = file_content.find('{', class_start, class_end)
+        if brace_pos != -1:
+            newline_pos = file_content.find('\n', brace_pos, class_end)
+            if newline_pos != -1:
+                header_end = newline_pos
+        class_header = file_content[class_start:header_end]
+        
+        # Chunk text is only joined when emitted; size is tracked incrementally
+        current_parts = [class_header]
+        current_size = len(class_header)
         current_methods = []
         
         # Add methods to chunks
         for method in methods[:10]:  # Limit methods per chunk
-            method_lines = method['full_signature'].split('\n')
-            if len('\n'.join(current_chunk + method_lines)) > max_size and current_chunk != class_header:
+            signature = method['full_signature']
+            if current_size + 1 + len(signature) > max_size and current_methods:
                 # Finalize current chunk
-                current_chunk.append('}')  # Close class
+                current_parts.append('}')  # Close class
                 chunks.append({
-                    'content': '\n'.join(current_chunk),
-                    'methods': current_methods[:]
+                    'content': '\n'.join(current_parts),
+                    'methods': current_methods
                 })
-                current_chunk = class_header[:]
+                current_parts = [class_header]
+                current_size = len(class_header)
                 current_methods = []
             
-            current_chunk.extend(method_lines)
+            current_parts.append(signature)
+            current_size += 1 + len(signature)
             current_methods.append(method['name'])
         
         # Add remaining chunk
-        if len(current_chunk) > len(class_header):
-            current_chunk.append('}')
+        if current_methods:
+            current_parts.append('}')
             chunks.append({
-                'content': '\n'.join(current_chunk),
+                'content': '\n'.join(current_parts),
                 'methods': current_methods
             })
         
@@ -291,35 +495,70 @@ class IntelligentTestGenerator:
     
     def generate_comprehensive_tests(self, file_content):
         """Generate comprehensive tests for large files"""
-        # Analyze the file
-        analysis = self.analyze_java_file(file_content)
+        cache_key = content_hasher(file_content.encode()).digest()
+        cached = self._cache_get(self.generation_cache, cache_key)
+        if cached is not None:
+            logger.info("Returning cached test suite")
+            return cached
+        
+        result = self._generate_comprehensive_tests(file_content, cache_key)
+        self._cache_put(self.generation_cache, cache_key, result)
+        return result
+    
+    def _generate_comprehensive_tests(self, file_content, cache_key):
+        """Analyze (reusing a cached analysis) and dispatch by file size"""
+        analysis = self._cache_get(self.analysis_cache, cache_key)
+        if analysis is None:
+            analysis = self.analyze_java_file(file_content)
+            self._cache_put(self.analysis_cache, cache_key, analysis)
         logger.info(f"File analysis: {analysis['line_count']} lines, {len(analysis['classes'])} classes, {len(analysis['methods'])} methods, complexity: {analysis['complexity_score']}")
         
+        if analysis['complexity_score'] < FAST_PATH_MAX_COMPLEXITY and analysis['line_count'] < FAST_PATH_MAX_LINES:
+            logger.info("Low-complexity file, using template fast path")
+            return self._generate_comprehensive_template(file_content, analysis)
+        
         if analysis['line_count'] > 1500:
             return self._generate_for_large_file(file_content, analysis)
         else:
             return self._generate_for_medium_file(file_content, analysis)
     
+    def _cache_get(self, cache, cache_key):
+        """LRU lookup; returns None on a miss"""
+        with self.cache_lock:
+            value = cache.get(cache_key)
+            if value is not None:
+                cache.move_to_end(cache_key)
+            return value
+    
+    def _cache_put(self, cache, cache_key, value):
+        """Insert into an LRU cache, evicting the oldest entry when full"""
+        with self.cache_lock:
+            cache[cache_key] = value
+            cache.move_to_end(cache_key)
+            while len(cache) > self.max_cache_size:
+                cache.popitem(last=False)
+    
     def _generate_for_large_file(self, file_content, analysis):
         """Handle very large files with intelligent chunking"""
         chunks = self.chunk_by_methods(file_content, analysis, max_chunk_size=3000)
         
         logger.info(f"Processing large file in {len(chunks)} intelligent chunks")
         
+        # Skip imports chunk for test generation
+        chunks = [chunk for chunk in chunks if chunk['type'] != 'imports']
+        
+        # Chunks are batched with those of concurrent requests; results stay in chunk order
+        if self.model is not None:
+            generated = self.scheduler.submit(chunks)
+        else:
+            generated = [None] * len(chunks)
+        
         test_files = []
         
-        for i, chunk in enumerate(chunks):
+        for i, (chunk, test_code) in enumerate(zip(chunks, generated)):
             logger.info(f"Processing chunk {i+1}/{len(chunks)}: {chunk['type']}")
             
-            if chunk['type'] == 'imports':
-                continue  # Skip imports chunk for test generation
-            
             try:
-                if self.model is not None:
-                    test_code = self._generate_with_model(chunk, analysis)
-                else:
-                    test_code = None
-                
                 if not test_code or len(test_code.strip()) < 100:
                     test_code = self._generate_template_for_chunk(chunk, analysis)
                 
@@ -352,51 +591,127 @@ class IntelligentTestGenerator:
             logger.error(f"Error in medium file generation: {str(e)}")
             return self._generate_comprehensive_template(file_content, analysis)
     
-    def _generate_with_model(self, chunk, analysis):
-        """Generate tests using the model for a chunk"""
-        prompt = f"""Generate comprehensive JUnit 5 test cases for this Java code chunk.
-
-Code Type: {chunk['type']}
+    def _build_chunk_prompt(self, chunk):
+        """Build the generation prompt for one chunk"""
+        return CHUNK_PROMPT_PREFIX + f"""Code Type: {chunk['type']}
 Metadata: {chunk['metadata']}
 
 Java Code:
 ```java
-{chunk['content'][:2000]}  # Limit context
+{chunk['content'][:2000]}
 ```
 
-Requirements:
-1. Use JUnit 5 annotations
-2. Include Mockito for mocking
-3. Test all public methods
-4. Include edge cases and error scenarios
-5. Proper assertions
-
 Test Code:"""
-
+    
+    def _generate_with_model(self, chunk, analysis):
+        """Generate tests using the model for a chunk"""
+        return self.scheduler.submit([chunk])[0]
+    
+    def _max_new_tokens(self, chunks):
+        """Decode budget sized to the most method-heavy chunk: 200 + 80 per method, capped at 1024"""
+        most_methods = max(len(chunk['metadata'].get('methods', [])) for chunk in chunks)
+        return min(1024, 200 + 80 * most_methods)
+    
+    def _generate_batch_with_model(self, chunks, batch_size=8):
+        """Generate tests for several chunks; transformers runs up to batch_size prompts per generate() call"""
+        prompts = [self._build_chunk_prompt(chunk) for chunk in chunks]
+        results = []
         try:
-            inputs = self.tokenizer(prompt, return_tensors="pt", max_length=2048, truncation=True)
-            inputs = inputs.to(self.device)
+            if self.backend == "llama_cpp":
+                for chunk, prompt in zip(chunks, prompts):
+                    output = self.model(
+                        prompt,
+                        max_tokens=self._max_new_tokens([chunk]),
+                        temperature=0.0,  # Greedy
+                        echo=False,
+                        stop=STOP_SEQUENCES
+                    )
+                    choice = output['choices'][0]
+                    text = choice['text'].rstrip()
+                    # llama.cpp drops the matched stop string; restore the class's closing brace
+                    if choice.get('finish_reason') == "stop" and not text.endswith("}"):
+                        text += "\n}"
+                    results.append(text.strip())
+                return results
             
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=1024,
-                    temperature=0.7,
-                    do_sample=True,
-                    top_p=0.9,
-                    pad_token_id=self.tokenizer.eos_token_id
+            for start in range(0, len(prompts), batch_size):
+                max_new_tokens = self._max_new_tokens(chunks[start:start + batch_size])
+                inputs = self.tokenizer(
+                    prompts[start:start + batch_size],
+                    return_tensors="pt",
+                    max_length=self.max_input_length,
+                    truncation=True,
+                    padding=True,
+                    pad_to_multiple_of=PROMPT_LENGTH_BUCKET
                 )
-            
-            generated = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # Extract generated part
-            if "Test Code:" in generated:
-                generated = generated.split("Test Code:")[-1].strip()
-            
-            return generated
+                inputs = self._to_device(inputs, batch_size)
+                
+                with torch.no_grad():
+                    outputs = self.model.generate(
+                        **inputs,
+                        max_new_tokens=max_new_tokens,
+                        do_sample=False,
+                        num_beams=1,
+                        eos_token_id=self.tokenizer.eos_token_id,
+                        pad_token_id=self.tokenizer.pad_token_id,
+                        stop_strings=STOP_SEQUENCES,
+                        tokenizer=self.tokenizer,
+                        # Fixed-size KV cache keeps decode shapes static for compiled graphs
+                        cache_implementation="static" if TORCH_COMPILE else None
+                    )
+                
+                for generated in self.tokenizer.batch_decode(outputs, skip_special_tokens=True):
+                    # Extract generated part
+                    if "Test Code:" in generated:
+                        generated = generated.split("Test Code:")[-1].strip()
+                    results.append(generated)
         except Exception as e:
             logger.error(f"Model generation error: {str(e)}")
-            return None
+        
+        # Chunks without output fall back to templates
+        results.extend([None] * (len(prompts) - len(results)))
+        return results
+    
+    def _to_device(self, inputs, batch_size):
+        """Stage tokenized inputs through reused pinned buffers for an async H2D copy"""
+        if self.device.type != "cuda":
+            return inputs.to(self.device)
+        
+        if self.input_buffers is None:
+            size = batch_size * self.max_input_length
+            self.input_buffers = {
+                name: (
+                    torch.empty(size, dtype=torch.long, pin_memory=True),
+                    torch.empty(size, dtype=torch.long, device=self.device)
+                )
+                for name in ("input_ids", "attention_mask")
+            }
+        
+        staged = {}
+        for name in ("input_ids", "attention_mask"):
+            tensor = inputs[name]
+            pinned, gpu = self.input_buffers[name]
+            count = tensor.numel()
+            # Flat prefixes keep the (batch, length) views contiguous
+            pinned[:count].copy_(tensor.view(-1))
+            gpu[:count].copy_(pinned[:count], non_blocking=True)
+            staged[name] = gpu[:count].view(tensor.shape)
+        return staged
+    
+    def _generate_with_model_single_pass(self, file_content, analysis):
+        """Generate tests for a whole medium-sized file in one model call"""
+        chunk = {
+            'content': file_content,
+            'type': 'file',
+            'metadata': {
+                'classes': [c['name'] for c in analysis['classes']],
+                'methods': [m['name'] for m in analysis['methods']]
+            }
+        }
+        test_code = self._generate_with_model(chunk, analysis)
+        if not test_code or len(test_code.strip()) < 100:
+            return self._generate_comprehensive_template(file_content, analysis)
+        return test_code
     
     def _generate_template_for_chunk(self, chunk, analysis):
         """Generate template-based tests for a chunk"""
@@ -477,7 +792,7 @@ class {class_name}Test {{
     
     def _combine_test_files(self, test_files, analysis):
         """Combine multiple test files into a comprehensive suite"""
-        combined = f"""/*
+        parts = [f"""/*
  * Comprehensive Test Suite
  * Generated for large file with {analysis['line_count']} lines
  * Classes: {len(analysis['classes'])}
@@ -485,23 +800,27 @@ class {class_name}Test {{
  * Complexity Score: {analysis['complexity_score']}
  */
 
-"""
+"""]
         
         for test_file in test_files:
-            combined += f"\n// === {test_file['type'].upper()} TESTS ===\n"
-            combined += test_file['test_code']
-            combined += "\n\n"
+            parts.append(f"\n// === {test_file['type'].upper()} TESTS ===\n{test_file['test_code']}\n\n")
         
-        return combined
+        return "".join(parts)
 
 # Global generator instance
 generator = IntelligentTestGenerator()
 
+# Load in the importing process so gunicorn --preload workers share the weights copy-on-write
+PRELOAD_MODEL = os.environ.get("PRELOAD_MODEL", "0") == "1"
+if PRELOAD_MODEL and __name__ != '__main__':
+    generator.initialize_model(os.environ.get("MODEL_PATH"))
+
 @app.route('/initialize-model', methods=['POST'])
 def initialize_model():
     """Initialize the intelligent model"""
     try:
-        success = generator.initialize_model()
+        data = request.get_json(silent=True) or {}
+        success = generator.initialize_model(data.get('model_path'))
         if success:
             return jsonify({"status": "Intelligent test generator initialized successfully"}), 200
         else:
@@ -550,7 +869,7 @@ def health():
         "status": "healthy",
         "model_status": model_status,
         "device": str(generator.device) if generator.device else "cpu",
-        "model_type": "Intelligent CodeT5+ with fallback",
+        "model_type": "GGUF via llama.cpp" if generator.backend == "llama_cpp" else "Intelligent CodeT5+ with fallback",
         "max_context": generator.max_context
     }), 200
 
@@ -563,4 +882,4 @@ if __name__ == '__main__':
     logger.info(f"Starting Intelligent Test Generator server on {args.host}:{args.port}")
     logger.info("Using intelligent chunking and analysis for large files")
     
-    app.run(host=args.host, port=args.port) 
\ No newline at end of file
+    app.run(host=args.host, port=args.port, threaded=True) 
\ No newline at end of file
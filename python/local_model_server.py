@@ -2,14 +2,25 @@
 """
 Local Model Server for Test Generation
 Uses CodeT5+ model loaded locally
+
+Production: serve with gunicorn instead of the Flask development server.
+Keep one worker so the model is loaded once; request threads wait on the
+prompt batcher, which coalesces them into batched generate() calls:
+  gunicorn -w 1 --threads 16 --timeout 600 -b 0.0.0.0:8080 local_model_server:app
 """
 
 import argparse
 import json
 import logging
+import os
+import re
 import torch
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from flask import Flask, request, jsonify
-from transformers import T5ForConditionalGeneration, RobertaTokenizer
+from transformers import T5ForConditionalGeneration, RobertaTokenizerFast
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -17,11 +28,70 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Opt-in torch.compile + static KV cache so decode steps replay as CUDA graphs
+TORCH_COMPILE = os.environ.get('TORCH_COMPILE', '0') == '1'
+# Prompt lengths are padded to multiples of this so compiled graphs see a few fixed shapes
+PROMPT_LENGTH_BUCKET = 128
+
+# Template fallback patterns, compiled once
+METHOD_NAME_RE = re.compile(r'public\s+\w+\s+(\w+)\s*\([^)]*\)')
+RETURN_TYPE_RE = re.compile(r'public\s+(\w+)\s+\w+\s*\([^)]*\)')
+
+class BatchedGenerator:
+    """Coalesces concurrent requests into batched generate() calls"""
+    
+    def __init__(self, generate_fn, max_batch=8, window_seconds=0.02):
+        self.generate_fn = generate_fn
+        self.max_batch = max_batch
+        self.window_seconds = window_seconds
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+    
+    def submit(self, prompt):
+        """Queue a prompt and block until its completion is ready"""
+        return self.submit_many([prompt])[0].result()
+    
+    def submit_many(self, prompts):
+        """Queue several prompts at once; returns one Future per prompt, in order"""
+        futures = []
+        for prompt in prompts:
+            future = Future()
+            self.queue.put((prompt, future))
+            futures.append(future)
+        return futures
+    
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            # Collect whatever else arrives within the window
+            deadline = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                results = self.generate_fn([prompt for prompt, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
 class LocalTestGenerator:
     def __init__(self):
         self.model = None
         self.tokenizer = None
         self.device = None
+        self.max_input_length = 512
+        self.batcher = BatchedGenerator(self.generate_tests)
+        # Reused pinned-host/GPU buffers for input_ids and attention_mask (CUDA only)
+        self.input_buffers = None
     
     def initialize_model(self):
         """Initialize the CodeT5+ model"""
@@ -33,15 +103,30 @@ class LocalTestGenerator:
             logger.info(f"Loading model: {model_name}")
             
             # Load tokenizer and model
-            self.tokenizer = RobertaTokenizer.from_pretrained(model_name)
+            self.tokenizer = RobertaTokenizerFast.from_pretrained(model_name)
             self.model = T5ForConditionalGeneration.from_pretrained(
                 model_name,
                 torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                device_map="auto" if torch.cuda.is_available() else None
+                device_map="auto" if torch.cuda.is_available() else None,
+                # Load straight into the final tensors (mmap'd when safetensors are published)
+                low_cpu_mem_usage=True
             )
             
-            if not torch.cuda.is_available():
-                self.model = self.model.to(self.device)
+            # Already placed by device_map (or on CPU); inputs follow the embedding weights
+            self.model.eval()
+            if TORCH_COMPILE:
+                self._compile_model()
+            self.device = next(self.model.parameters()).device
+            
+            if self.device.type == "cuda":
+                size = self.batcher.max_batch * self.max_input_length
+                self.input_buffers = {
+                    name: (
+                        torch.empty(size, dtype=torch.long, pin_memory=True),
+                        torch.empty(size, dtype=torch.long, device=self.device)
+                    )
+                    for name in ("input_ids", "attention_mask")
+                }
             
             logger.info("Model loaded successfully")
             return True
@@ -49,38 +134,73 @@ class LocalTestGenerator:
             logger.error(f"Failed to initialize model: {str(e)}")
             return False
     
+    def _compile_model(self):
+        """Compile the forward pass; generate() stays on the module and calls the compiled forward"""
+        try:
+            self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead", fullgraph=False)
+            logger.info("Model forward compiled with torch.compile")
+        except Exception as e:
+            logger.warning(f"torch.compile unavailable, running eager: {str(e)}")
+    
     def generate_test(self, java_code):
-        """Generate test code using the local model"""
+        """Generate test code using the local model (batched with concurrent requests)"""
         if self.model is None or self.tokenizer is None:
             raise Exception("Model not initialized")
         
-        # Prepare prompt for CodeT5+
-        prompt = f"Generate JUnit test cases for the following Java method:\n\n{java_code}\n\nTest cases:"
+        return self.batcher.submit(java_code)
+    
+    def _to_device(self, inputs):
+        """Stage tokenized inputs through the reused pinned buffers for an async H2D copy"""
+        if self.input_buffers is None:
+            return inputs.to(self.device, non_blocking=True)
+        
+        staged = {}
+        for name in ("input_ids", "attention_mask"):
+            tensor = inputs[name]
+            pinned, gpu = self.input_buffers[name]
+            count = tensor.numel()
+            # Flat prefixes keep the (batch, length) views contiguous
+            pinned[:count].copy_(tensor.view(-1))
+            gpu[:count].copy_(pinned[:count], non_blocking=True)
+            staged[name] = gpu[:count].view(tensor.shape)
+        return staged
+    
+    def generate_tests(self, java_codes):
+        """Generate test code for several inputs in one padded generate() call"""
+        # Prepare prompts for CodeT5+
+        prompts = [
+            f"Generate JUnit test cases for the following Java method:\n\n{java_code}\n\nTest cases:"
+            for java_code in java_codes
+        ]
         
         # Tokenize input
-        inputs = self.tokenizer.encode(prompt, return_tensors="pt", max_length=512, truncation=True)
-        inputs = inputs.to(self.device)
+        inputs = self.tokenizer(prompts, return_tensors="pt", max_length=self.max_input_length, truncation=True,
+                                padding=True, pad_to_multiple_of=PROMPT_LENGTH_BUCKET)
+        inputs = self._to_device(inputs)
         
         # Generate response
-        with torch.no_grad():
+        with torch.inference_mode():
             outputs = self.model.generate(
-                inputs,
+                **inputs,
                 max_length=1024,
                 num_return_sequences=1,
+                use_cache=True,  # Decoder reuses its KV cache and the encoder output per token
                 temperature=0.7,
                 do_sample=True,
                 top_p=0.95,
-                pad_token_id=self.tokenizer.eos_token_id
+                pad_token_id=self.tokenizer.eos_token_id,
+                cache_implementation="static" if TORCH_COMPILE else None
             )
         
-        # Decode response
-        generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        # Decode responses
+        results = []
+        for generated_text in self.tokenizer.batch_decode(outputs, skip_special_tokens=True):
+            # Clean up the response (remove the input prompt)
+            if "Test cases:" in generated_text:
+                generated_text = generated_text.split("Test cases:")[-1].strip()
+            results.append(generated_text)
         
-        # Clean up the response (remove the input prompt)
-        if "Test cases:" in generated_text:
-            generated_text = generated_text.split("Test cases:")[-1].strip()
-        
-        return generated_text
+        return results
 
 # Global model instance
 generator = LocalTestGenerator()
@@ -143,14 +263,12 @@ def generate():
 
 def generate_template_test(java_code):
     """Fallback template-based test generation"""
-    import re
-    
     # Extract method name
-    method_match = re.search(r'public\s+\w+\s+(\w+)\s*\([^)]*\)', java_code)
+    method_match = METHOD_NAME_RE.search(java_code)
     method_name = method_match.group(1) if method_match else "testMethod"
     
     # Extract return type
-    return_match = re.search(r'public\s+(\w+)\s+\w+\s*\([^)]*\)', java_code)
+    return_match = RETURN_TYPE_RE.search(java_code)
     return_type = return_match.group(1) if return_match else "void"
     
     template = f"""
@@ -214,4 +332,4 @@ if __name__ == '__main__':
     logger.info(f"Starting Local Model Test Generator server on {args.host}:{args.port}")
     logger.info("Using CodeT5+ model locally")
     
-    app.run(host=args.host, port=args.port) 
\ No newline at end of file
+    app.run(host=args.host, port=args.port, threaded=True) 
\ No newline at end of file